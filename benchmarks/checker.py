@@ -0,0 +1,92 @@
+"""Availability checks per second against checker processes count.
+
+Checks local http servers, results are sent to in-process fake kafka producer:
+
+    python -m benchmarks.checker --checks 20000 --processes 1 2 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+from benchmarks.local import FakeKafkaProducer, run_http_server
+from service import config
+from service.entities import SiteCheck
+from service.http_client import http_client_factory
+from service.jobs import availability_check
+from service.utils import AdaptiveLimiter, ChecksCache
+
+PORT = 18080
+
+
+async def run_checks(checks, concurrency):
+    ctx = {
+        "http_client": http_client_factory(
+            dict(config.HTTP_CLIENT_CONFIG, max_connections=concurrency, max_keepalive_connections=concurrency)
+        ),
+        "checks_cache": ChecksCache(),
+        "concurrency_limiter": AdaptiveLimiter(concurrency, concurrency),
+        "kafka_producer": FakeKafkaProducer(),
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def check(i):
+        async with semaphore:
+            await availability_check(ctx, SiteCheck(id=i, url=f"http://127.0.0.1:{PORT}/{i}", regexp="x{10}"))
+
+    await asyncio.gather(*(check(i) for i in range(checks)))
+    await ctx["http_client"].aclose()
+
+
+def checker_process(checks, concurrency, start_event, results):
+    logging.getLogger().setLevel(logging.WARNING)
+    start_event.wait()
+    start = time.perf_counter()
+    asyncio.run(run_checks(checks, concurrency))
+    results.put(time.perf_counter() - start)
+
+
+def benchmark(checks, processes, concurrency):
+    context = multiprocessing.get_context("spawn")
+    start_event = context.Event()
+    results = context.Queue()
+    workers = [
+        context.Process(target=checker_process, args=(checks // processes, concurrency, start_event, results))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    time.sleep(1)  # wait processes start
+    start_event.set()
+    durations = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return checks // processes * processes / max(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=10000)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=config.AVAILABILITY_CHECKER_MAX_JOBS)
+    parser.add_argument("--servers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    servers = [context.Process(target=run_http_server, args=(PORT,), daemon=True) for _ in range(args.servers)]
+    for server in servers:
+        server.start()
+    time.sleep(1)  # wait servers start
+    try:
+        for processes in args.processes:
+            rate = benchmark(args.checks, processes, args.concurrency)
+            print(f"processes={processes:<3} checks={args.checks:<8} rate={rate:.0f}/s")
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
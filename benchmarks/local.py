@@ -0,0 +1,159 @@
+"""Local stand-ins of external services for benchmarks."""
+import asyncio
+import math
+import random
+import time
+from collections import namedtuple
+from dataclasses import dataclass
+from typing import Tuple
+
+from aiokafka.structs import TopicPartition
+
+from service import config
+
+
+async def serve_http(port, body_size=1024, latency=0):
+    # keep alive http server which responds with the same body to any request
+    await serve_http_farm(port, FarmProfile(latency_median=latency, latency_p99=latency, body_sizes=(body_size,)))
+
+
+def run_http_server(port, body_size=1024, latency=0):
+    asyncio.run(serve_http(port, body_size, latency))
+
+
+@dataclass
+class FarmProfile:
+    # response latency is log-normal with given median and 99th percentile, body size is chosen
+    # uniformly, errors are 500 responses and resets are connections closed without response
+    latency_median: float = 0  # seconds
+    latency_p99: float = 0  # seconds
+    body_sizes: Tuple[int, ...] = (1024,)  # bytes
+    error_rate: float = 0
+    reset_rate: float = 0
+
+    def latency(self):
+        if not self.latency_median:
+            return 0
+        sigma = math.log(max(self.latency_p99, self.latency_median) / self.latency_median) / 2.326
+        return random.lognormvariate(math.log(self.latency_median), sigma)
+
+
+async def serve_http_farm(port, profile):
+    responses = [
+        b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (size, b"x" * size) for size in profile.body_sizes
+    ]
+    error = b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 5\r\n\r\nerror"
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                latency = profile.latency()
+                if latency:
+                    await asyncio.sleep(latency)
+                chance = random.random()
+                if chance < profile.reset_rate:
+                    break
+                writer.write(error if chance < profile.reset_rate + profile.error_rate else random.choice(responses))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port, reuse_port=True)
+    async with server:
+        await server.serve_forever()
+
+
+def run_http_farm_server(port, profile):
+    asyncio.run(serve_http_farm(port, profile))
+
+
+class FakeRedis:
+    """Arq redis pool stand-in, enqueued jobs are kept in memory."""
+
+    SET_IF_NOT_EXIST = "SET_IF_NOT_EXIST"
+
+    def __init__(self):
+        self.jobs = []
+
+    async def enqueue_job(self, function, *args, **kwargs):
+        self.jobs.append((function, args, kwargs))
+        return True
+
+    async def set(self, key, value, **kwargs):
+        return True
+
+    async def delete(self, *keys):
+        pass
+
+    async def flushdb(self):
+        self.jobs.clear()
+
+
+class FakeKafkaProducer:
+    def __init__(self, keep=False):
+        self.sent = 0
+        self.values = [] if keep else None
+
+    async def send(self, topic, value):
+        self.sent += 1
+        if self.values is not None:
+            self.values.append(value)
+        delivery = asyncio.get_event_loop().create_future()
+        delivery.set_result(None)
+        return delivery
+
+    async def send_and_wait(self, topic, value):
+        return await (await self.send(topic, value))
+
+    async def flush(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+ConsumerRecord = namedtuple("ConsumerRecord", ["offset", "value"])
+
+
+class FakeKafkaConsumer:
+    """Kafka consumer stand-in reading given values spread by partitions.
+
+    Time from fetch or previous commit to commit of partition is kept as batch write latency.
+    """
+
+    def __init__(self, values, partitions=1):
+        self._partitions = {
+            TopicPartition(config.KAFKA_TOPIC, partition): [
+                ConsumerRecord(offset, value) for offset, value in enumerate(values[partition::partitions])
+            ]
+            for partition in range(partitions)
+        }
+        self._positions = dict.fromkeys(self._partitions, 0)
+        self._mark = None
+        self.latencies = []
+
+    async def getmany(self, timeout_ms=0, max_records=None):
+        # like kafka consumer max records limits total count of fetched records
+        result = {}
+        remaining = max_records or sum(map(len, self._partitions.values()))
+        for tp, records in self._partitions.items():
+            batch = records[self._positions[tp] : self._positions[tp] + remaining]
+            remaining -= len(batch)
+            if batch:
+                result[tp] = batch
+                self._positions[tp] += len(batch)
+        self._mark = time.perf_counter()
+        return result
+
+    def highwater(self, tp):
+        return len(self._partitions[tp])
+
+    async def commit(self, offsets):
+        now = time.perf_counter()
+        self.latencies.append(now - self._mark)
+        self._mark = now
+
+    async def stop(self):
+        pass
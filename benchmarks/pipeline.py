@@ -0,0 +1,190 @@
+"""End-to-end scheduling, checks and transfer throughput with local stand-ins.
+
+Sites point to local http server farm with configurable latency, body size and error
+distributions. Scheduling runs against postgres from docker-compose in separate `benchmark`
+schema which is dropped after run, redis and kafka are in-process fakes by default:
+
+    python -m benchmarks.pipeline --sites 10000 --latency 0.05 --latency-p99 0.5 --error-rate 0.01
+
+Results are printed as json with throughput, p50/p99 latency and peak memory per stage, so they
+can be stored and compared between revisions.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import time
+
+from benchmarks.local import FakeKafkaConsumer, FakeKafkaProducer, FakeRedis, FarmProfile, run_http_farm_server
+from service import config
+from service.db import SiteCheckPgManager, ensure_db_configured, postgres_cursor, postgres_pool_factory
+from service.http_client import http_client_factory
+from service.jobs import availability_check, kafka_to_pg_transfer, redis_pool_factory, schedule_availability_checks
+from service.utils import AdaptiveLimiter, ChecksCache
+
+SCHEMA = "benchmark"
+PORT = 18180
+
+
+def percentile(values, q):
+    # nearest rank percentile, None for no values
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def stage_report(stage, count, duration, latencies):
+    return {
+        "stage": stage,
+        "count": count,
+        "duration": duration,
+        "throughput": count / duration if duration else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+async def create_sites(pool, sites, servers):
+    async with postgres_cursor(pool) as cursor:
+        await cursor.execute(
+            """
+            INSERT INTO sites (url, regexp, check_interval, next_check_at)
+            SELECT 'http://127.0.0.1:' || (%s + i %% %s) || '/' || i, 'x{10}', 60, LOCALTIMESTAMP
+            FROM generate_series(1, %s) AS i
+        """,
+            (PORT, servers, sites),
+        )
+
+
+async def benchmark_schedule(pool, redis, repeats):
+    # throughput is counted by really enqueued jobs, queue is flushed between runs, so job ids of
+    # the previous run don't deduplicate sites, and checks aren't deferred by jitter
+    ctx = {"pg_pool": pool, "redis_pool": redis}
+    durations = []
+    count = 0
+    jitter_window, config.SCHEDULE_JITTER_WINDOW = config.SCHEDULE_JITTER_WINDOW, 0
+    try:
+        for _ in range(repeats):
+            await redis.flushdb()
+            async with postgres_cursor(pool) as cursor:
+                await cursor.execute("UPDATE sites SET next_check_at = LOCALTIMESTAMP")
+            start = time.perf_counter()
+            count += await schedule_availability_checks(ctx)
+            durations.append(time.perf_counter() - start)
+    finally:
+        config.SCHEDULE_JITTER_WINDOW = jitter_window
+    return stage_report("schedule", count, sum(durations), durations)
+
+
+async def benchmark_checks(pool, producer, concurrency):
+    async with postgres_cursor(pool) as cursor:
+        site_checks = [site_check async for site_check in SiteCheckPgManager(cursor).get_all()]
+    ctx = {
+        "http_client": http_client_factory(
+            dict(config.HTTP_CLIENT_CONFIG, max_connections=concurrency, max_keepalive_connections=concurrency)
+        ),
+        "checks_cache": ChecksCache(),
+        "concurrency_limiter": AdaptiveLimiter(concurrency, concurrency),
+        "kafka_producer": producer,
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def check(site_check):
+        async with semaphore:
+            check_start = time.perf_counter()
+            await availability_check(ctx, site_check)
+            latencies.append(time.perf_counter() - check_start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(check(site_check) for site_check in site_checks))
+    duration = time.perf_counter() - start
+    await ctx["http_client"].aclose()
+    return stage_report("check", len(site_checks), duration, latencies)
+
+
+async def benchmark_transfer(pool, values, partitions):
+    consumer = FakeKafkaConsumer(values, partitions)
+    start = time.perf_counter()
+    await kafka_to_pg_transfer({"pg_pool": pool, "kafka_consumer": consumer})
+    return stage_report("transfer", len(values), time.perf_counter() - start, consumer.latencies)
+
+
+async def benchmark(args):
+    admin_pool = await postgres_pool_factory(config.POSTGRES_CONFIG)
+    async with postgres_cursor(admin_pool) as cursor:
+        await cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    # all service tables are created in benchmark schema, so service code runs unchanged
+    pool = await postgres_pool_factory(dict(config.POSTGRES_CONFIG, options=f"-c search_path={SCHEMA}"))
+    redis = await redis_pool_factory(dict(config.REDIS_CONFIG, database=config.REDIS_DB + 1)) if args.redis else None
+    try:
+        await ensure_db_configured(pool)
+        await create_sites(pool, args.sites, args.servers)
+        if redis is not None:
+            await redis.flushdb()
+        producer = FakeKafkaProducer(keep=True)
+        return [
+            await benchmark_schedule(pool, redis or FakeRedis(), args.repeats),
+            await benchmark_checks(pool, producer, args.concurrency),
+            await benchmark_transfer(pool, producer.values, args.partitions),
+        ]
+    finally:
+        if redis is not None:
+            await redis.flushdb()
+            redis.close()
+            await redis.wait_closed()
+        pool.close()
+        await pool.wait_closed()
+        async with postgres_cursor(admin_pool) as cursor:
+            await cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        admin_pool.close()
+        await admin_pool.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sites", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=3, help="scheduling runs")
+    parser.add_argument("--concurrency", type=int, default=config.AVAILABILITY_CHECKER_MAX_JOBS)
+    parser.add_argument("--partitions", type=int, default=6, help="fake kafka topic partitions")
+    parser.add_argument("--servers", type=int, default=os.cpu_count(), help="http server farm processes")
+    parser.add_argument("--latency", type=float, default=0, help="median response latency, seconds")
+    parser.add_argument("--latency-p99", type=float, default=0, help="99th percentile response latency, seconds")
+    parser.add_argument("--body-sizes", type=int, nargs="+", default=[1024], help="bytes")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of 500 responses")
+    parser.add_argument("--reset-rate", type=float, default=0, help="share of connections reset")
+    parser.add_argument("--redis", action="store_true", help="use redis from docker-compose instead of fake")
+    parser.add_argument("--output", help="json file, stdout by default")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    profile = FarmProfile(args.latency, args.latency_p99, tuple(args.body_sizes), args.error_rate, args.reset_rate)
+    context = multiprocessing.get_context("spawn")
+    servers = [
+        context.Process(target=run_http_farm_server, args=(PORT + i, profile), daemon=True) for i in range(args.servers)
+    ]
+    for server in servers:
+        server.start()
+    time.sleep(1)  # wait servers start
+    try:
+        stages = asyncio.run(benchmark(args))
+    finally:
+        for server in servers:
+            server.terminate()
+
+    report = json.dumps({"params": vars(args), "stages": stages}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Sites scheduled per second against schedule batch size.
+
+Run with redis from docker-compose, it uses the same database as tests and flushes it:
+
+    python -m benchmarks.schedule --sites 100000 --batch-sizes 1 10 100 1000
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from service import config
+from service.entities import SiteCheck
+from service.jobs import redis_pool_factory, enqueue_availability_checks
+
+
+async def generate_site_checks(count):
+    for i in range(count):
+        yield SiteCheck(id=i + 1, url=f"http://site{i}.test", regexp="test")
+
+
+async def benchmark(sites, batch_sizes):
+    redis = await redis_pool_factory(dict(config.REDIS_CONFIG, database=config.REDIS_DB + 1))
+    try:
+        for batch_size in batch_sizes:
+            await redis.flushdb()
+            start = time.perf_counter()
+            count = await enqueue_availability_checks(redis, generate_site_checks(sites), batch_size=batch_size)
+            duration = time.perf_counter() - start
+            print(f"batch_size={batch_size:<6} sites={count:<8} duration={duration:.3f}s rate={count / duration:.0f}/s")
+        await redis.flushdb()
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sites", type=int, default=10000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)  # measure redis round trips, not per site log lines
+    asyncio.run(benchmark(args.sites, args.batch_sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Event encode/decode microbenchmarks for json and binary formats.
+
+    python -m benchmarks.serialization --number 100000
+"""
+import argparse
+import timeit
+from datetime import datetime
+
+from service.entities import Event
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    event = Event(None, datetime.now(), "https://www.python.org/downloads/", 0.123, 200, True)
+    for name, binary in (("json", False), ("binary", True)):
+        serialized = event.serialize(binary=binary)
+        encode = timeit.timeit(lambda: event.serialize(binary=binary), number=args.number)
+        decode = timeit.timeit(lambda: Event.deserialize(serialized), number=args.number)
+        print(
+            f"format={name:<6} size={len(serialized):<4} "
+            f"encode={args.number / encode:.0f}/s decode={args.number / decode:.0f}/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
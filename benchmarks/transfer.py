@@ -0,0 +1,62 @@
+"""Events written to postgres per second against insert batch size.
+
+Run with postgres from docker-compose, it writes to separate table which is dropped after run:
+
+    python -m benchmarks.transfer --events 100000 --batch-sizes 1 10 100 1000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from service import config
+from service.db import EventPgManager, postgres_pool_factory, postgres_cursor
+from service.entities import Event
+
+
+class BenchmarkEventPgManager(EventPgManager):
+
+    table = "events_benchmark"
+
+
+async def write_one_by_one(manager, events):
+    for event in events:
+        await manager.create(event.created_at, event.url, event.duration, event.status_code, event.regexp_found)
+
+
+async def benchmark(events_count, batch_sizes):
+    events = [Event(None, datetime.now(), f"http://site{i}.test", 0.1, 200, True) for i in range(events_count)]
+    pool = await postgres_pool_factory(config.POSTGRES_CONFIG)
+    try:
+        async with postgres_cursor(pool) as cursor:
+            manager = BenchmarkEventPgManager(cursor)
+            await manager.create_pg_schema()
+            for batch_size in batch_sizes:
+                await manager.delete_all()
+                start = time.perf_counter()
+                for i in range(0, events_count, batch_size):
+                    batch = events[i : i + batch_size]
+                    await cursor.execute("BEGIN")
+                    if batch_size == 1:
+                        await write_one_by_one(manager, batch)
+                    else:
+                        await manager.create_many(batch)
+                    await cursor.execute("COMMIT")
+                duration = time.perf_counter() - start
+                print(f"batch_size={batch_size:<6} rows={events_count:<8} rate={events_count / duration:.0f}/s")
+            await cursor.execute(f"DROP TABLE {manager.table}")
+    finally:
+        pool.close()
+        await pool.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.events, args.batch_sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import logging
 import os
-import sys
 
 from dotenv import load_dotenv
 
+from service.logs import configure_logging
+
 load_dotenv()
 
 POSTGRES_HOST = os.environ["POSTGRES_HOST"]
@@ -35,8 +36,11 @@ REDIS_CONFIG = {
 
 KAFKA_SERVERS = os.environ["KAFKA_SERVERS"]
 KAFKA_TOPIC = "events"
+# json or binary, transfer worker reads both formats, so producers can be switched one by one
+KAFKA_EVENT_FORMAT = os.environ.get("KAFKA_EVENT_FORMAT", "json")
 KAFKA_CONSUMER_WAIT_TIMEOUT = 1000
 KAFKA_CONSUMER_MAX_RECORDS = 1000
+TRANSFER_RETRY_BACKOFF = 5  # seconds
 
 KAFKA_SECURITY_PROTOCOL = os.environ.get("KAFKA_SECURITY_PROTOCOL", "PLAINTEXT")
 KAFKA_ACCESS_KEY = os.environ.get("KAFKA_ACCESS_KEY")
@@ -49,11 +53,27 @@ if KAFKA_SECURITY_PROTOCOL == "SSL":
         "certfile": KAFKA_ACCESS_CERTIFICATE,
         "keyfile": KAFKA_ACCESS_KEY,
     }
+# by default every event waits broker acknowledge, without it events are sent in background batches
+# collected for linger time and delivery errors are reported by callback
+KAFKA_PRODUCER_WAIT_DELIVERY = bool(int(os.environ.get("KAFKA_PRODUCER_WAIT_DELIVERY", 1)))
+KAFKA_PRODUCER_LINGER_MS = int(os.environ.get("KAFKA_PRODUCER_LINGER_MS", 0))
+KAFKA_PRODUCER_COMPRESSION_TYPE = os.environ.get("KAFKA_PRODUCER_COMPRESSION_TYPE")  # gzip, snappy or lz4
 KAFKA_PRODUCER_CONFIG = {
     "bootstrap_servers": KAFKA_SERVERS,
     "security_protocol": KAFKA_SECURITY_PROTOCOL,
     "ssl_context": KAFKA_SSL_CONTEXT,
+    "linger_ms": KAFKA_PRODUCER_LINGER_MS,
+    "compression_type": KAFKA_PRODUCER_COMPRESSION_TYPE,
 }
+# checker spools events to local disk when kafka doesn't take event for timeout or fails it, spooled
+# events are replayed in order in background and new events are spooled till replay catches up,
+# empty path disables spool
+KAFKA_SPOOL_PATH = os.environ.get("KAFKA_SPOOL_PATH", "")
+KAFKA_SPOOL_TIMEOUT = float(os.environ.get("KAFKA_SPOOL_TIMEOUT", 1))  # seconds
+KAFKA_SPOOL_SEGMENT_SIZE = int(os.environ.get("KAFKA_SPOOL_SEGMENT_SIZE", 16 * 1024 * 1024))  # bytes
+KAFKA_SPOOL_MAX_SIZE = int(os.environ.get("KAFKA_SPOOL_MAX_SIZE", 1024 * 1024 * 1024))  # bytes
+KAFKA_SPOOL_REPLAY_BATCH = 1000
+KAFKA_SPOOL_REPLAY_INTERVAL = 5  # seconds
 KAFKA_CONSUMER_CONFIG = {
     "bootstrap_servers": KAFKA_SERVERS,
     "security_protocol": KAFKA_SECURITY_PROTOCOL,
@@ -63,13 +83,76 @@ KAFKA_CONSUMER_CONFIG = {
 }
 
 FETCH_TIMEOUT = 10  # seconds
+# streaming fetch reads body by chunks and stops on the first pattern match or size limit, pattern
+# matches crossing chunks boundary are found if they aren't longer than overlap
+FETCH_STREAMING = bool(int(os.environ.get("FETCH_STREAMING", 0)))
+FETCH_MAX_BODY_SIZE = int(os.environ.get("FETCH_MAX_BODY_SIZE", 10 * 1024 * 1024))  # bytes
+FETCH_REGEXP_OVERLAP = 4096  # bytes
+# pattern-less sites are checked with HEAD request, GET is used for servers rejecting HEAD
+FETCH_HEAD_ONLY = bool(int(os.environ.get("FETCH_HEAD_ONLY", 0)))
+# pattern sites are checked with conditional GET, not modified response reuses previous verdict
+FETCH_CONDITIONAL = bool(int(os.environ.get("FETCH_CONDITIONAL", 0)))
+FETCH_CONDITIONAL_CACHE_SIZE = 10000  # urls per checker process
+SITE_CHECK_DEFAULT_INTERVAL = 60  # seconds
+REGEXP_CACHE_SIZE = 10000  # compiled patterns per checker process
 PG_FETCH_CHUNK_SIZE = 10000
-AVAILABILITY_CHECKER_MAX_JOBS = 50
+# events table is partitioned by day, partitions are created a few days ahead and dropped after
+# retention period
+EVENTS_PARTITIONS_AHEAD = 3  # days
+EVENTS_RETENTION_DAYS = int(os.environ.get("EVENTS_RETENTION_DAYS", 30))
+EVENTS_MAINTENANCE_INTERVAL = 3600  # seconds
+# checks concurrency per process is adapted between min and max jobs by event loop lag and checks
+# duration growth, equal values disable adaptation
+AVAILABILITY_CHECKER_MAX_JOBS = int(os.environ.get("AVAILABILITY_CHECKER_MAX_JOBS", 50))  # per process
+AVAILABILITY_CHECKER_MIN_JOBS = int(os.environ.get("AVAILABILITY_CHECKER_MIN_JOBS", 5))  # per process
+CHECKER_LAG_THRESHOLD = float(os.environ.get("CHECKER_LAG_THRESHOLD", 0.1))  # seconds
+CHECKER_LATENCY_INFLATION = float(os.environ.get("CHECKER_LATENCY_INFLATION", 2))
+# availability check worker processes started by service.supervisor, default is cpu count
+CHECKER_PROCESSES = int(os.environ.get("CHECKER_PROCESSES", 0)) or os.cpu_count()
+CHECKER_PROCESSES_STOP_TIMEOUT = 30  # seconds
+# prometheus /metrics endpoint port of every worker, checker processes use next ports, 0 disables it
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+# checks are deferred by deterministic per site offset inside of window to spread them evenly
+# between scheduler ticks, 0 disables it
+SCHEDULE_JITTER_WINDOW = int(os.environ.get("SCHEDULE_JITTER_WINDOW", 60))  # seconds
+# checker http client connections pool, keep alive connections are reused by next checks of the
+# same host, so they skip tcp and tls handshakes, expiry should be bigger than check interval,
+# connections per host is the only politeness limit of checks of the same host, 0 disables it
+HTTP_CLIENT_CONFIG = {
+    "max_connections": int(os.environ.get("HTTP_MAX_CONNECTIONS", AVAILABILITY_CHECKER_MAX_JOBS)),
+    "max_connections_per_host": int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", 4)) or None,
+    "max_keepalive_connections": int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", AVAILABILITY_CHECKER_MAX_JOBS)),
+    "keepalive_expiry": float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 75)),  # seconds
+    "http2": bool(int(os.environ.get("HTTP2", 0))),
+}
+# scheduler skips due sites while checks queue has more jobs than high water mark, 0 disables it
+SCHEDULE_QUEUE_HIGH_WATER = int(os.environ.get("SCHEDULE_QUEUE_HIGH_WATER", 0))
+# sites are split between schedulers by id remainder, every scheduler has own shard number from 0
+# to shards count - 1 and own queue
+SCHEDULER_SHARDS = int(os.environ.get("SCHEDULER_SHARDS", 1))
+SCHEDULER_SHARD = int(os.environ.get("SCHEDULER_SHARD", 0))
+# sites per scheduled job, 1 means job per site, bigger values enqueue one job with a chunk of
+# sites which checker fans out locally, so scheduler does one redis round trip per chunk
+SCHEDULE_BATCH_SIZE = int(os.environ.get("SCHEDULE_BATCH_SIZE", 1))
+# batch job timeout, checks of batch can wait for free slot or host connection one after another and
+# every check waits for connection and fetch not longer than fetch timeout each
+AVAILABILITY_CHECK_BATCH_TIMEOUT = int(
+    os.environ.get("AVAILABILITY_CHECK_BATCH_TIMEOUT", max(300, SCHEDULE_BATCH_SIZE * 2 * FETCH_TIMEOUT))
+)  # seconds
+# bounded queues of service.embedded, scheduler waits when jobs queue (it includes deferred checks)
+# is full and checks wait when events queue is full
+EMBEDDED_JOBS_QUEUE_SIZE = int(os.environ.get("EMBEDDED_JOBS_QUEUE_SIZE", 10000))
+EMBEDDED_EVENTS_QUEUE_SIZE = int(os.environ.get("EMBEDDED_EVENTS_QUEUE_SIZE", 1000))
+
+# records are written to stdout by listener thread instead of event loop, 0 writes them in place
+LOG_QUEUE = bool(int(os.environ.get("LOG_QUEUE", 1)))
+# share of kept per item records of hot path (started check, scheduled site, transferred batch),
+# 0 drops them, so only summaries are logged
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.001))
+# checks and transferred events summary is logged at most once per interval
+LOG_SUMMARY_INTERVAL = float(os.environ.get("LOG_SUMMARY_INTERVAL", 10))  # seconds
+
+# json lines with extra fields of records or plain text
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+configure_logging(logging.INFO, queued=LOG_QUEUE, sample_rate=LOG_SAMPLE_RATE, json_format=LOG_FORMAT == "json")
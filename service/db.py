@@ -1,15 +1,29 @@
 import contextlib
+import dataclasses
+import json
+import logging
+import re
+from datetime import datetime, timedelta
 
 import aiopg
 
 from service import config
-from service.entities import SiteCheck, Event
+from service.entities import SiteCheck, Event, Rollup
+from service.rollups import MINUTE, HOUR
+from service.utils import compile_pattern
+
+
+logger = logging.getLogger()
 
 
 async def postgres_pool_factory(config):
     return await aiopg.create_pool(**config)
 
 
+def jsonb(value):
+    return json.dumps(value) if value is not None else None
+
+
 @contextlib.asynccontextmanager
 async def postgres_cursor(pool):
     async with pool.acquire() as conn:
@@ -24,22 +38,25 @@ class SiteCheckPgManager:
     def __init__(self, cursor):
         self._cursor = cursor
 
-    async def create(self, url, regexp):
+    async def create(self, url, regexp, interval=config.SITE_CHECK_DEFAULT_INTERVAL, next_check_at=None, patterns=None):
+        for pattern in [regexp, *(patterns or [])]:
+            if pattern is not None and compile_pattern(pattern) is None:
+                raise ValueError(f"invalid regexp: {pattern}")
         await self._cursor.execute(
             f"""
-            INSERT INTO {self.table} (url, regexp)
-            VALUES (%s, %s)
+            INSERT INTO {self.table} (url, regexp, check_interval, next_check_at, patterns)
+            VALUES (%s, %s, %s, %s, %s)
             RETURNING (id)
         """,
-            (url, regexp),
+            (url, regexp, interval, next_check_at or datetime.now(), patterns),
         )
         (site_check_id,) = await self._cursor.fetchone()
-        return SiteCheck(site_check_id, url, regexp)
+        return SiteCheck(site_check_id, url, regexp, interval, patterns)
 
     async def get_by_id(self, site_id):
         await self._cursor.execute(
             f"""
-            SELECT id, url, regexp
+            SELECT id, url, regexp, check_interval, patterns
             FROM {self.table}
             WHERE id = %s
         """,
@@ -51,18 +68,104 @@ class SiteCheckPgManager:
         return None
 
     async def get_all(self):
-        await self._cursor.execute(
-            f"""
-            SELECT id, url, regexp
-            FROM {self.table}
-        """
-        )
+        # keyset pagination by primary key, so not more than chunk of sites is kept in memory,
+        # client side cursor of async connection reads whole result on execute
+        after_id = 0
         while True:
-            raw_entities = await self._cursor.fetchmany(config.PG_FETCH_CHUNK_SIZE)
-            if not raw_entities:
-                break
+            await self._cursor.execute(
+                f"""
+                SELECT id, url, regexp, check_interval, patterns
+                FROM {self.table}
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s
+            """,
+                (after_id, config.PG_FETCH_CHUNK_SIZE),
+            )
+            raw_entities = await self._cursor.fetchall()
             for raw_entity in raw_entities:
                 yield SiteCheck(*raw_entity)
+            if len(raw_entities) < config.PG_FETCH_CHUNK_SIZE:
+                break
+            after_id = raw_entities[-1][0]
+
+    async def claim_due(self, now=None, shard=0, shards=1):
+        # due sites moved to the next check time in the same statement, so scheduler reads only
+        # sites which need check now via next_check_at index and concurrent tick can't get them
+        # twice, next check time is the first time after now at site phase, phase is offset of url
+        # hash inside of interval, so sites added together are spread over their interval and
+        # scheduler behind for whole interval doesn't do burst of catch up checks
+        # sites are claimed by chunks in order of previous check time, rows locked by concurrent
+        # scheduler are skipped, every scheduler of sharded mode claims only sites with own id
+        # remainder
+        now = now or datetime.now()
+        after = (datetime.min, 0)
+        while True:
+            await self._cursor.execute(
+                f"""
+                WITH due AS (
+                    SELECT id, next_check_at
+                    FROM {self.table}
+                    WHERE next_check_at <= %(now)s
+                    AND (next_check_at, id) > (%(after_at)s, %(after_id)s)
+                    AND id %% %(shards)s = %(shard)s
+                    ORDER BY next_check_at, id
+                    LIMIT %(limit)s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE {self.table} AS site
+                SET next_check_at = %(now)s + (
+                    site.check_interval - MOD(
+                        EXTRACT(EPOCH FROM %(now)s::TIMESTAMP)::NUMERIC
+                        - MOD(MOD(hashtext(site.url), site.check_interval) + site.check_interval, site.check_interval),
+                        site.check_interval
+                    )
+                ) * INTERVAL '1 second'
+                FROM due
+                WHERE site.id = due.id
+                RETURNING site.id, site.url, site.regexp, site.check_interval, site.patterns, due.next_check_at
+            """,
+                {
+                    "now": now,
+                    "after_at": after[0],
+                    "after_id": after[1],
+                    "shard": shard,
+                    "shards": shards,
+                    "limit": config.PG_FETCH_CHUNK_SIZE,
+                },
+            )
+            raw_entities = await self._cursor.fetchall()
+            for position, (*raw_entity, _) in enumerate(raw_entities):
+                try:
+                    yield SiteCheck(*raw_entity)
+                except GeneratorExit:
+                    # reader stopped, e.g. on enqueue error, sites of chunk it didn't get are due again
+                    try:
+                        await self._unclaim(raw_entities[position + 1 :])
+                    except Exception:
+                        logger.exception("failed to unclaim not scheduled due sites")
+                    raise
+            if len(raw_entities) < config.PG_FETCH_CHUNK_SIZE:
+                break
+            after = max((previous_check_at, site_id) for site_id, *_, previous_check_at in raw_entities)
+
+    async def _unclaim(self, raw_entities):
+        # previous check time is restored, so not scheduled sites are claimed by the next tick
+        if not raw_entities:
+            return
+        await self._cursor.execute(
+            f"""
+            UPDATE {self.table} AS site
+            SET next_check_at = unclaimed.next_check_at
+            FROM UNNEST(%(ids)s::INTEGER[], %(next_check_at)s::TIMESTAMP[]) AS unclaimed (id, next_check_at)
+            WHERE site.id = unclaimed.id
+        """,
+            {
+                "ids": [site_id for site_id, *_ in raw_entities],
+                "next_check_at": [next_check_at for *_, next_check_at in raw_entities],
+            },
+        )
+        logger.warning("unclaimed not scheduled due sites: %s", len(raw_entities))
 
     async def delete_all(self):
         await self._cursor.execute(
@@ -73,8 +176,8 @@ class SiteCheckPgManager:
         )
 
     async def create_pg_schema(self):
-        # assume we can prevent duplicates by url to avoid duplicate checks, so only one regexp
-        # can be specified in this case
+        # assume we can prevent duplicates by url to avoid duplicate checks, so several content
+        # assertions for url are specified as patterns checked in one pass
         await self._cursor.execute(
             f"""
             CREATE TABLE IF NOT EXISTS {self.table} (
@@ -83,6 +186,22 @@ class SiteCheckPgManager:
                 regexp VARCHAR(255)
             )"""
         )
+        # check interval in seconds, scheduler runs every minute, so smaller intervals work as
+        # minute interval
+        await self._cursor.execute(
+            f"""
+            ALTER TABLE {self.table}
+            ADD COLUMN IF NOT EXISTS check_interval INT NOT NULL DEFAULT {config.SITE_CHECK_DEFAULT_INTERVAL},
+            ADD COLUMN IF NOT EXISTS next_check_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+            ADD COLUMN IF NOT EXISTS patterns VARCHAR(255)[] NULL
+        """
+        )
+        await self._cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {self.table}_next_check_at_idx
+            ON {self.table} (next_check_at)
+        """
+        )
 
 
 class EventPgManager:
@@ -92,22 +211,55 @@ class EventPgManager:
     def __init__(self, cursor):
         self._cursor = cursor
 
-    async def create(self, created_at, url, duration, status_code, regexp_found):
+    async def create(self, created_at, url, duration, status_code, regexp_found, patterns_found=None, timings=None):
         await self._cursor.execute(
             f"""
-            INSERT INTO {self.table} (created_at, url, duration, status_code, regexp_found)
-            VALUES (%s, %s, %s, %s, %s)
+            INSERT INTO {self.table} (
+                created_at, url, duration, status_code, regexp_found, patterns_found, timings
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
             RETURNING (id)
         """,
-            (created_at, url, duration, status_code, regexp_found),
+            (created_at, url, duration, status_code, regexp_found, jsonb(patterns_found), jsonb(timings)),
         )
         (event_id,) = await self._cursor.fetchone()
-        return Event(event_id, created_at, url, duration, status_code, regexp_found)
+        return Event(event_id, created_at, url, duration, status_code, regexp_found, patterns_found, timings)
+
+    async def create_many(self, events):
+        # single multi-row insert for batch of not persisted events, COPY could be faster, but it
+        # isn't supported by async connections
+        if not events:
+            return []
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(events))
+        await self._cursor.execute(
+            f"""
+            INSERT INTO {self.table} (
+                created_at, url, duration, status_code, regexp_found, patterns_found, timings
+            )
+            VALUES {values}
+            RETURNING (id)
+        """,
+            [
+                v
+                for e in events
+                for v in (
+                    e.created_at,
+                    e.url,
+                    e.duration,
+                    e.status_code,
+                    e.regexp_found,
+                    jsonb(e.patterns_found),
+                    jsonb(e.timings),
+                )
+            ],
+        )
+        event_ids = await self._cursor.fetchall()
+        return [dataclasses.replace(event, id=event_id) for event, (event_id,) in zip(events, event_ids)]
 
     async def get_by_id(self, site_id):
         await self._cursor.execute(
             f"""
-            SELECT id, created_at, url, duration, status_code, regexp_found
+            SELECT id, created_at, url, duration, status_code, regexp_found, patterns_found, timings
             FROM {self.table}
             WHERE id = %s
         """,
@@ -121,7 +273,7 @@ class EventPgManager:
     async def get_all(self):
         await self._cursor.execute(
             f"""
-            SELECT id, created_at, url, duration, status_code, regexp_found
+            SELECT id, created_at, url, duration, status_code, regexp_found, patterns_found, timings
             FROM {self.table}
         """
         )
@@ -141,22 +293,379 @@ class EventPgManager:
         )
 
     async def create_pg_schema(self):
-        # there are no indexes for this table, however they are can be added for appropriate use
-        # cases
+        # table partitioned by day, so old events are removed by dropping of whole partitions,
+        # default partition keeps events out of created partitions ranges
+        await self._cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (self.table,))
+        raw_kind = await self._cursor.fetchone()
+        if raw_kind is not None and raw_kind[0] == "r":
+            await self._migrate_to_partitions()
+            return
+        await self._create_partitioned_table()
+        await self.ensure_partitions()
+
+    async def _create_partitioned_table(self):
         await self._cursor.execute(
             f"""
             CREATE TABLE IF NOT EXISTS {self.table} (
-                id SERIAL PRIMARY KEY,
-                created_at TIMESTAMP,
+                id SERIAL,
+                created_at TIMESTAMP NOT NULL,
                 url VARCHAR(255),
                 duration FLOAT,
                 status_code INT NULL,
+                regexp_found BOOL NULL,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)"""
+        )
+        await self._add_columns(self.table)
+        await self._cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.table}_default PARTITION OF {self.table} DEFAULT")
+        await self._cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_url_created_at_idx ON {self.table} (url, created_at)"
+        )
+
+    async def _add_columns(self, table):
+        # columns added after the first version
+        await self._cursor.execute(
+            f"""
+            ALTER TABLE {table}
+            ADD COLUMN IF NOT EXISTS patterns_found JSONB NULL,
+            ADD COLUMN IF NOT EXISTS timings JSONB NULL
+        """
+        )
+
+    async def _migrate_to_partitions(self):
+        # not partitioned table of previous versions becomes partition for all events before the
+        # day after its last event, so rows created today fit it too
+        legacy_table = f"{self.table}_legacy"
+        await self._cursor.execute("BEGIN")
+        try:
+            await self._cursor.execute(f"SELECT MAX(created_at) FROM {self.table}")
+            (last_created_at,) = await self._cursor.fetchone()
+            legacy_end = last_created_at.date() + timedelta(days=1) if last_created_at else datetime.now().date()
+            await self._cursor.execute(f"ALTER TABLE {self.table} RENAME TO {legacy_table}")
+            await self._cursor.execute(f"ALTER TABLE {legacy_table} ALTER COLUMN created_at SET NOT NULL")
+            await self._add_columns(legacy_table)
+            # primary key is replaced with partitioned table one on attach
+            await self._cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'", (legacy_table,)
+            )
+            for (constraint,) in await self._cursor.fetchall():
+                await self._cursor.execute(f"ALTER TABLE {legacy_table} DROP CONSTRAINT {constraint}")
+            await self._create_partitioned_table()
+            await self._cursor.execute(
+                f"""
+                SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT COALESCE(MAX(id), 0) + 1 FROM {legacy_table}))
+            """,
+                (self.table,),
+            )
+            await self._cursor.execute(
+                f"""
+                ALTER TABLE {self.table}
+                ATTACH PARTITION {legacy_table} FOR VALUES FROM (MINVALUE) TO (%s)
+            """,
+                (legacy_end,),
+            )
+        except BaseException:
+            await self._cursor.execute("ROLLBACK")
+            raise
+        await self._cursor.execute("COMMIT")
+        await self.ensure_partitions()
+
+    async def ensure_partitions(self, now=None):
+        today = (now or datetime.now()).date()
+        # days before end of legacy partition are kept in it
+        legacy_end = dict(await self.get_partitions()).get(f"{self.table}_legacy")
+        for day in range(config.EVENTS_PARTITIONS_AHEAD + 1):
+            start = today + timedelta(days=day)
+            if legacy_end is not None and start < legacy_end.date():
+                continue
+            try:
+                await self._create_partition(start)
+            except Exception:
+                # partition is created again by next maintenance, events of its day are kept in
+                # default partition till then
+                logger.exception("failed to create events partition for day: %s", start)
+
+    async def _create_partition(self, start):
+        partition = f"{self.table}_p{start:%Y%m%d}"
+        end = start + timedelta(days=1)
+        await self._cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (partition,))
+        if (await self._cursor.fetchone())[0]:
+            return
+        await self._cursor.execute("BEGIN")
+        try:
+            # events of the day kept in default partition (e.g. maintenance was stopped for a few
+            # days) are moved to new partition, otherwise default partition constraint is violated
+            await self._cursor.execute(
+                f"CREATE TABLE {partition} (LIKE {self.table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            )
+            await self._cursor.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {self.table}_default
+                    WHERE created_at >= %s AND created_at < %s
+                    RETURNING *
+                )
+                INSERT INTO {partition}
+                SELECT * FROM moved
+            """,
+                (start, end),
+            )
+            await self._cursor.execute(
+                f"ALTER TABLE {self.table} ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s)", (start, end)
+            )
+        except BaseException:
+            await self._cursor.execute("ROLLBACK")
+            raise
+        await self._cursor.execute("COMMIT")
+
+    async def get_partitions(self):
+        # partition name with its range end, None for default partition
+        await self._cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+            ORDER BY child.relname
+        """,
+            (self.table,),
+        )
+        partitions = []
+        for name, bound in await self._cursor.fetchall():
+            match = re.search(r"TO \('([^']+)'\)", bound)
+            partitions.append((name, datetime.fromisoformat(match.group(1)) if match else None))
+        return partitions
+
+    async def drop_expired_partitions(self, now=None):
+        expired_before = (now or datetime.now()) - timedelta(days=config.EVENTS_RETENTION_DAYS)
+        dropped = []
+        for name, end in await self.get_partitions():
+            if end is not None and end <= expired_before:
+                await self._cursor.execute(f"DROP TABLE {name}")
+                dropped.append(name)
+        await self._cursor.execute(
+            f"DELETE FROM {self.table}_default WHERE created_at < %s",
+            (expired_before,),
+        )
+        return dropped
+
+
+class SiteStatusPgManager:
+    """Latest event per url."""
+
+    table = "site_status"
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def upsert_many(self, events):
+        # only the newest event of url is written, so stored status is never replaced by older
+        # event from delayed batch
+        latest = {}
+        for event in events:
+            if event.url not in latest or latest[event.url].created_at <= event.created_at:
+                latest[event.url] = event
+        if not latest:
+            return
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(latest))
+        await self._cursor.execute(
+            f"""
+            INSERT INTO {self.table} AS status (
+                url, event_id, created_at, duration, status_code, regexp_found, patterns_found
+            )
+            VALUES {values}
+            ON CONFLICT (url) DO UPDATE SET
+                event_id = EXCLUDED.event_id,
+                created_at = EXCLUDED.created_at,
+                duration = EXCLUDED.duration,
+                status_code = EXCLUDED.status_code,
+                regexp_found = EXCLUDED.regexp_found,
+                patterns_found = EXCLUDED.patterns_found
+            WHERE status.created_at <= EXCLUDED.created_at
+        """,
+            [
+                v
+                for e in sorted(latest.values(), key=lambda e: e.url)  # the same rows lock order for batches
+                for v in (e.url, e.id, e.created_at, e.duration, e.status_code, e.regexp_found, jsonb(e.patterns_found))
+            ],
+        )
+
+    async def get_by_url(self, url):
+        await self._cursor.execute(
+            f"""
+            SELECT event_id, created_at, url, duration, status_code, regexp_found, patterns_found
+            FROM {self.table}
+            WHERE url = %s
+        """,
+            (url,),
+        )
+        raw_entity = await self._cursor.fetchone()
+        if raw_entity is not None:
+            return Event(*raw_entity)
+        return None
+
+    async def get_all(self):
+        await self._cursor.execute(
+            f"""
+            SELECT event_id, created_at, url, duration, status_code, regexp_found, patterns_found
+            FROM {self.table}
+        """
+        )
+        while True:
+            raw_entities = await self._cursor.fetchmany(config.PG_FETCH_CHUNK_SIZE)
+            if not raw_entities:
+                break
+            for raw_entity in raw_entities:
+                yield Event(*raw_entity)
+
+    async def delete_all(self):
+        await self._cursor.execute(
+            f"""
+            DELETE
+            FROM {self.table}
+        """
+        )
+
+    async def create_pg_schema(self):
+        await self._cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                url VARCHAR(255) PRIMARY KEY,
+                event_id INT,
+                created_at TIMESTAMP,
+                duration FLOAT,
+                status_code INT NULL,
                 regexp_found BOOL NULL
             )"""
         )
+        await self._cursor.execute(f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS patterns_found JSONB NULL")
+
+
+class RollupPgManager:
+
+    table = None
+    resolution = None
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def upsert_many(self, rollups):
+        # rollups of the same url and bucket are merged with already stored one
+        if not rollups:
+            return
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(rollups))
+        await self._cursor.execute(
+            f"""
+            INSERT INTO {self.table} AS rollup (
+                url, bucket, count, failures, regexp_misses,
+                duration_min, duration_max, duration_sum, latency_sketch
+            )
+            VALUES {values}
+            ON CONFLICT (url, bucket) DO UPDATE SET
+                count = rollup.count + EXCLUDED.count,
+                failures = rollup.failures + EXCLUDED.failures,
+                regexp_misses = rollup.regexp_misses + EXCLUDED.regexp_misses,
+                duration_min = LEAST(rollup.duration_min, EXCLUDED.duration_min),
+                duration_max = GREATEST(rollup.duration_max, EXCLUDED.duration_max),
+                duration_sum = rollup.duration_sum + EXCLUDED.duration_sum,
+                latency_sketch = (
+                    SELECT jsonb_object_agg(key, total)
+                    FROM (
+                        SELECT key, SUM(value::INT) AS total
+                        FROM (
+                            SELECT * FROM jsonb_each_text(rollup.latency_sketch)
+                            UNION ALL
+                            SELECT * FROM jsonb_each_text(EXCLUDED.latency_sketch)
+                        ) AS counts
+                        GROUP BY key
+                    ) AS merged
+                )
+        """,
+            [
+                v
+                for r in rollups
+                for v in (
+                    r.url,
+                    r.bucket,
+                    r.count,
+                    r.failures,
+                    r.regexp_misses,
+                    r.duration_min,
+                    r.duration_max,
+                    r.duration_sum,
+                    json.dumps(r.latency_sketch),
+                )
+            ],
+        )
+
+    async def get_by_url(self, url, start, end):
+        await self._cursor.execute(
+            f"""
+            SELECT url, bucket, count, failures, regexp_misses,
+                duration_min, duration_max, duration_sum, latency_sketch
+            FROM {self.table}
+            WHERE url = %s AND bucket >= %s AND bucket < %s
+            ORDER BY bucket
+        """,
+            (url, start, end),
+        )
+        while True:
+            raw_entities = await self._cursor.fetchmany(config.PG_FETCH_CHUNK_SIZE)
+            if not raw_entities:
+                break
+            for *raw_entity, latency_sketch in raw_entities:
+                yield Rollup(*raw_entity, {int(k): v for k, v in latency_sketch.items()})
+
+    async def delete_all(self):
+        await self._cursor.execute(
+            f"""
+            DELETE
+            FROM {self.table}
+        """
+        )
+
+    async def create_pg_schema(self):
+        await self._cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                url VARCHAR(255),
+                bucket TIMESTAMP,
+                count INT,
+                failures INT,
+                regexp_misses INT,
+                duration_min FLOAT,
+                duration_max FLOAT,
+                duration_sum FLOAT,
+                latency_sketch JSONB,
+                PRIMARY KEY (url, bucket)
+            )"""
+        )
+
+
+class MinuteRollupPgManager(RollupPgManager):
+
+    table = "events_rollup_minute"
+    resolution = MINUTE
+
+
+class HourRollupPgManager(RollupPgManager):
+
+    table = "events_rollup_hour"
+    resolution = HOUR
 
 
 async def ensure_db_configured(pool):
     async with postgres_cursor(pool) as cursor:
         await SiteCheckPgManager(cursor).create_pg_schema()
         await EventPgManager(cursor).create_pg_schema()
+        await SiteStatusPgManager(cursor).create_pg_schema()
+        await MinuteRollupPgManager(cursor).create_pg_schema()
+        await HourRollupPgManager(cursor).create_pg_schema()
+
+
+async def maintain_events_partitions(pool):
+    async with postgres_cursor(pool) as cursor:
+        manager = EventPgManager(cursor)
+        await manager.ensure_partitions()
+        dropped = await manager.drop_expired_partitions()
+    logger.info("events partitions maintained, dropped: %s", dropped)
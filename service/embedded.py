@@ -0,0 +1,254 @@
+"""Single process pipeline without redis and kafka.
+
+    python -m service.embedded
+
+Scheduler, checks and transfer run in one event loop with the same jobs and postgres write path as
+separate workers, but they are wired by bounded in-memory queues: scheduled checks wait in jobs
+queue instead of redis and serialized events wait in events queue instead of kafka. It fits small
+catalogs and local profiling, queued checks and events are lost on exit.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import signal
+import time
+from collections import namedtuple
+
+import arq
+
+from service import config
+from service.db import postgres_cursor
+from service.entities import Event
+from service.jobs import (
+    AvailabilityCheckerWorkerSettings,
+    enqueue_availability_checks,
+    schedule_availability_checks,
+    shutdown,
+    startup,
+    write_events,
+)
+from service.transfer import maintain_events
+
+
+logger = logging.getLogger()
+
+SCHEDULE_INTERVAL = 60  # seconds, the same as scheduler cron tick
+
+Message = namedtuple("Message", ["offset", "value"])
+
+
+class JobsQueue:
+    """Arq redis pool stand-in, deferred jobs are kept in memory ordered by start time.
+
+    Enqueue waits for free place when queue is full, job id isn't enqueued again till the job is
+    done, not started jobs are dropped after expiry like arq does. Keys with expiry stand in for
+    redis keys set by scheduler.
+    """
+
+    SET_IF_NOT_EXIST = "SET_IF_NOT_EXIST"
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self.expired = 0
+        self._jobs = []  # heap of (start time, sequence, expiry time, job id, function, args)
+        self._job_ids = set()
+        self._sequence = itertools.count()
+        self._changed = asyncio.Condition()
+        self._keys = {}  # key -> expiry time
+
+    async def enqueue_job(self, function, *args, _job_id=None, _queue_name=None, _defer_by=None, _expires=None):
+        if _job_id is not None and _job_id in self._job_ids:
+            return None
+        async with self._changed:
+            await self._changed.wait_for(lambda: not self.maxsize or len(self._jobs) < self.maxsize)
+            now = time.monotonic()
+            start = now + (_defer_by or 0)
+            heapq.heappush(
+                self._jobs, (start, next(self._sequence), _expires and now + _expires, _job_id, function, args)
+            )
+            if _job_id is not None:
+                self._job_ids.add(_job_id)
+            self._changed.notify_all()
+        return _job_id
+
+    async def zcard(self, key):
+        return len(self._jobs)
+
+    async def get(self):
+        async with self._changed:
+            while True:
+                delay = None
+                if self._jobs:
+                    delay = self._jobs[0][0] - time.monotonic()
+                    if delay <= 0:
+                        _, _, expires, job_id, function, args = heapq.heappop(self._jobs)
+                        self._changed.notify_all()
+                        if expires and expires < time.monotonic():
+                            self.expired += 1
+                            self.done(job_id)
+                            continue
+                        return job_id, function, args
+                try:
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def done(self, job_id):
+        self._job_ids.discard(job_id)
+
+    async def set(self, key, value, *, expire=0, pexpire=0, exist=None):
+        now = time.monotonic()
+        if exist == self.SET_IF_NOT_EXIST and self._keys.get(key, now) > now:
+            return None
+        self._keys[key] = now + (expire or pexpire / 1000 or float("inf"))
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._keys.pop(key, None)
+
+    def close(self):
+        pass
+
+
+class EventsQueue:
+    """Kafka producer stand-in, serialized events are put to bounded queue read by writer."""
+
+    def __init__(self, maxsize=0):
+        self.queue = asyncio.Queue(maxsize)
+
+    async def send(self, topic, value):
+        await self.queue.put(value)
+        delivery = asyncio.get_event_loop().create_future()
+        delivery.set_result(None)
+        return delivery
+
+    async def send_and_wait(self, topic, value):
+        await self.queue.put(value)
+
+    async def flush(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class PgStore:
+    def __init__(self, pg_pool):
+        self.pg_pool = pg_pool
+
+    async def schedule(self, jobs):
+        await schedule_availability_checks({"pg_pool": self.pg_pool, "redis_pool": jobs})
+
+    async def write(self, messages):
+        async with postgres_cursor(self.pg_pool) as cursor:
+            await write_events(cursor, messages)
+
+    async def maintain(self):
+        # daily events partitions are created ahead and expired ones are dropped like by transfer
+        await maintain_events(self.pg_pool)
+
+
+class MemoryStore:
+    """Sites and events kept in memory for tests and profiling without postgres."""
+
+    def __init__(self, site_checks):
+        self.sites = [[0, site_check] for site_check in site_checks]  # [next check time, site]
+        self.events = []
+
+    async def schedule(self, jobs):
+        count = await enqueue_availability_checks(
+            jobs,
+            self._claim_due(),
+            batch_size=config.SCHEDULE_BATCH_SIZE,
+            jitter_window=config.SCHEDULE_JITTER_WINDOW,
+            high_water=config.SCHEDULE_QUEUE_HIGH_WATER,
+        )
+        logger.info("finished availability checks scheduling: scheduled %s sites", count)
+
+    async def write(self, messages):
+        self.events.extend(Event.deserialize(message.value) for message in messages)
+
+    async def maintain(self):
+        pass
+
+    async def _claim_due(self):
+        now = time.time()
+        for site in self.sites:
+            if site[0] <= now:
+                site[0] = now + site[1].interval
+                yield site[1]
+
+
+async def run_scheduler(store, jobs):
+    while True:
+        try:
+            await store.schedule(jobs)
+        except Exception:
+            logger.exception("failed availability checks scheduling")
+        await asyncio.sleep(SCHEDULE_INTERVAL - time.time() % SCHEDULE_INTERVAL)
+
+
+async def run_checker(ctx, jobs):
+    functions = {function.name: function for function in map(arq.func, AvailabilityCheckerWorkerSettings.functions)}
+    while True:
+        job_id, function, args = await jobs.get()
+        try:
+            # job timeout is applied like arq worker does
+            await asyncio.wait_for(functions[function].coroutine(ctx, *args), functions[function].timeout_s)
+        except Exception:
+            logger.exception("failed embedded job: %s", job_id)
+        finally:
+            jobs.done(job_id)
+
+
+async def run_writer(store, events, batch_size):
+    offsets = itertools.count()
+    while True:
+        # batch is what is already queued, so writer doesn't wait for full batch
+        messages = [Message(next(offsets), await events.get())]
+        while len(messages) < batch_size and not events.empty():
+            messages.append(Message(next(offsets), events.get_nowait()))
+        try:
+            await store.write(messages)
+        except Exception:
+            logger.exception("failed events write, lost events count: %s", len(messages))
+
+
+async def run_pipeline(ctx, store, checkers=config.AVAILABILITY_CHECKER_MAX_JOBS):
+    # ctx has http clients and limiters of checker, jobs and events queues replace redis pool and
+    # kafka producer
+    tasks = [
+        asyncio.ensure_future(run_scheduler(store, ctx["redis_pool"])),
+        asyncio.ensure_future(run_writer(store, ctx["kafka_producer"].queue, config.KAFKA_CONSUMER_MAX_RECORDS)),
+        asyncio.ensure_future(store.maintain()),
+        *(asyncio.ensure_future(run_checker(ctx, ctx["redis_pool"])) for _ in range(checkers)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def main():
+    ctx = {}
+    await startup(ctx, http=True, postgres=True, metrics_server=True)
+    ctx["redis_pool"] = JobsQueue(config.EMBEDDED_JOBS_QUEUE_SIZE)
+    ctx["kafka_producer"] = EventsQueue(config.EMBEDDED_EVENTS_QUEUE_SIZE)
+    pipeline = asyncio.ensure_future(run_pipeline(ctx, PgStore(ctx["pg_pool"])))
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, pipeline.cancel)
+    try:
+        await pipeline
+    except asyncio.CancelledError:
+        logger.info("embedded pipeline stopped")
+    finally:
+        await shutdown(ctx)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
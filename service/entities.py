@@ -1,8 +1,32 @@
 import json
+import struct
 from dataclasses import dataclass
-from datetime import datetime
-from functools import partial
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+EPOCH = datetime(1970, 1, 1)  # naive as entities datetimes
+MICROSECOND = timedelta(microseconds=1)
+
+# binary event layout: version, flags, id, created_at as epoch microseconds, duration, status code
+# and UTF8 url till the end, json serialized event always starts with "{" so it can't be confused
+# with binary version byte
+# version 2 has url length before url and optional sections marked by flags after it, version 1 is
+# still written for events without optional fields, so not upgraded consumers can read them
+EVENT_BINARY_VERSION = 1
+EVENT_BINARY_VERSION_SECTIONS = 2
+EVENT_BINARY_HEADER = struct.Struct("<BBqqdH")
+EVENT_BINARY_LENGTH = struct.Struct("<H")
+EVENT_BINARY_PATTERN = struct.Struct("<?H")  # found, pattern length before UTF8 pattern
+EVENT_FLAG_ID = 1
+EVENT_FLAG_STATUS_CODE = 2
+EVENT_FLAG_REGEXP_CHECKED = 4
+EVENT_FLAG_REGEXP_FOUND = 8
+EVENT_FLAG_PATTERNS = 16
+EVENT_FLAG_TIMINGS = 32
+# request phases durations in seconds, bit of phase is set in timings mask when phase is measured
+TIMING_PHASES = ("queue", "dns", "connect", "tls", "ttfb", "download")
+EVENT_BINARY_TIMINGS_MASK = struct.Struct("<B")
+EVENT_BINARY_TIMING = struct.Struct("<d")
 
 
 def datetime_default(obj):
@@ -11,10 +35,7 @@ def datetime_default(obj):
 
 
 def detetime_restore(data, key):
-    try:
-        data[key] = datetime.strptime(data[key], "%Y-%m-%dT%H:%M:%S.%f")
-    except ValueError:
-        data[key] = datetime.strptime(data[key], "%Y-%m-%dT%H:%M:%S")
+    data[key] = datetime.fromisoformat(data[key])
     return data
 
 
@@ -23,6 +44,8 @@ class SiteCheck:
     id: Optional[int]  # None for not persisted entity
     url: str
     regexp: Optional[str] = None  # UTF8 encoded pattern, will check binary representation of it
+    interval: int = 60  # seconds between checks
+    patterns: Optional[List[str]] = None  # UTF8 encoded patterns checked in one pass in addition to regexp
 
 
 @dataclass
@@ -33,10 +56,108 @@ class Event:
     duration: float
     status_code: Optional[int] = None  # None for http error or timeout
     regexp_found: Optional[bool] = None  # None in case of empty regexp or no response
+    patterns_found: Optional[Dict[str, bool]] = None  # None in case of no patterns or no response
+    timings: Optional[Dict[str, float]] = None  # measured phases of TIMING_PHASES, None if not measured
 
-    def serialize(self):
+    def serialize(self, binary=False):
+        if binary:
+            return self._serialize_binary()
         return json.dumps(self.__dict__, default=datetime_default).encode("utf8")
 
     @classmethod
     def deserialize(cls, data):
-        return cls(**json.loads(data.decode("utf8"), object_hook=partial(detetime_restore, key="created_at")))
+        # format is detected by data, so consumers read both formats during producers upgrade
+        if data[:1] != b"{":
+            return cls._deserialize_binary(data)
+        # restored for top level object only, nested objects are patterns and timings dicts
+        return cls(**detetime_restore(json.loads(data.decode("utf8")), key="created_at"))
+
+    def _serialize_binary(self):
+        flags = 0
+        if self.id is not None:
+            flags |= EVENT_FLAG_ID
+        if self.status_code is not None:
+            flags |= EVENT_FLAG_STATUS_CODE
+        if self.regexp_found is not None:
+            flags |= EVENT_FLAG_REGEXP_CHECKED
+            if self.regexp_found:
+                flags |= EVENT_FLAG_REGEXP_FOUND
+        sections = []
+        if self.patterns_found is not None:
+            flags |= EVENT_FLAG_PATTERNS
+            sections.append(EVENT_BINARY_LENGTH.pack(len(self.patterns_found)))
+            for pattern, found in self.patterns_found.items():
+                encoded_pattern = pattern.encode("utf8")
+                sections.append(EVENT_BINARY_PATTERN.pack(found, len(encoded_pattern)))
+                sections.append(encoded_pattern)
+        if self.timings is not None:
+            flags |= EVENT_FLAG_TIMINGS
+            phases = [(i, phase) for i, phase in enumerate(TIMING_PHASES) if phase in self.timings]
+            sections.append(EVENT_BINARY_TIMINGS_MASK.pack(sum(1 << i for i, _ in phases)))
+            sections.extend(EVENT_BINARY_TIMING.pack(self.timings[phase]) for _, phase in phases)
+        header = EVENT_BINARY_HEADER.pack(
+            EVENT_BINARY_VERSION_SECTIONS if sections else EVENT_BINARY_VERSION,
+            flags,
+            self.id or 0,
+            (self.created_at - EPOCH) // MICROSECOND,
+            self.duration,
+            self.status_code or 0,
+        )
+        url = self.url.encode("utf8")
+        if not sections:
+            return header + url
+        return b"".join([header, EVENT_BINARY_LENGTH.pack(len(url)), url, *sections])
+
+    @classmethod
+    def _deserialize_binary(cls, data):
+        version, flags, event_id, created_at, duration, status_code = EVENT_BINARY_HEADER.unpack_from(data)
+        if version not in (EVENT_BINARY_VERSION, EVENT_BINARY_VERSION_SECTIONS):
+            raise ValueError(f"unsupported event binary version: {version}")
+        event = cls(
+            id=event_id if flags & EVENT_FLAG_ID else None,
+            created_at=EPOCH + created_at * MICROSECOND,
+            url="",
+            duration=duration,
+            status_code=status_code if flags & EVENT_FLAG_STATUS_CODE else None,
+            regexp_found=bool(flags & EVENT_FLAG_REGEXP_FOUND) if flags & EVENT_FLAG_REGEXP_CHECKED else None,
+        )
+        offset = EVENT_BINARY_HEADER.size
+        if version == EVENT_BINARY_VERSION:
+            event.url = data[offset:].decode("utf8")
+            return event
+
+        (url_length,) = EVENT_BINARY_LENGTH.unpack_from(data, offset)
+        offset += EVENT_BINARY_LENGTH.size
+        event.url = data[offset : offset + url_length].decode("utf8")
+        offset += url_length
+        if flags & EVENT_FLAG_PATTERNS:
+            event.patterns_found = {}
+            (patterns_count,) = EVENT_BINARY_LENGTH.unpack_from(data, offset)
+            offset += EVENT_BINARY_LENGTH.size
+            for _ in range(patterns_count):
+                found, pattern_length = EVENT_BINARY_PATTERN.unpack_from(data, offset)
+                offset += EVENT_BINARY_PATTERN.size
+                event.patterns_found[data[offset : offset + pattern_length].decode("utf8")] = found
+                offset += pattern_length
+        if flags & EVENT_FLAG_TIMINGS:
+            event.timings = {}
+            (mask,) = EVENT_BINARY_TIMINGS_MASK.unpack_from(data, offset)
+            offset += EVENT_BINARY_TIMINGS_MASK.size
+            for i, phase in enumerate(TIMING_PHASES):
+                if mask & 1 << i:
+                    (event.timings[phase],) = EVENT_BINARY_TIMING.unpack_from(data, offset)
+                    offset += EVENT_BINARY_TIMING.size
+        return event
+
+
+@dataclass
+class Rollup:
+    url: str
+    bucket: datetime  # start of rollup period
+    count: int
+    failures: int  # checks without response or with error status code
+    regexp_misses: int
+    duration_min: float
+    duration_max: float
+    duration_sum: float
+    latency_sketch: Dict[int, int]  # latency sketch bucket -> checks count, see service.rollups
@@ -0,0 +1,232 @@
+import asyncio
+import contextlib
+import socket
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+import httpcore
+import httpx
+from httpcore._backends.asyncio import AsyncioBackend, SocketStream
+from httpcore._utils import url_to_origin
+
+from service import metrics
+
+# monotonic marks of current request: start, acquired, resolved, connected, tls, headers, end
+request_marks: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_marks", default=None)
+# origins which connection slots are held by current check, its requests don't wait for them again
+held_hosts: ContextVar[Tuple[Tuple[bytes, bytes, int], ...]] = ContextVar("held_hosts", default=())
+
+
+def http_client_factory(config):
+    transport = CheckerConnectionPool(
+        # one ssl context for all connections, handshake is skipped for reused keep alive connections
+        ssl_context=httpx.create_ssl_context(http2=config["http2"]),
+        max_connections=config["max_connections"],
+        max_keepalive_connections=config["max_keepalive_connections"],
+        keepalive_expiry=config["keepalive_expiry"],
+        http2=config["http2"],
+        max_connections_per_host=config["max_connections_per_host"],
+        backend=TimingBackend(),
+    )
+    return httpx.AsyncClient(transport=transport)
+
+
+def connection_stats(client: httpx.AsyncClient):
+    return dict(getattr(client._transport, "stats", {}))
+
+
+@contextlib.asynccontextmanager
+async def host_slot(client: httpx.AsyncClient, url: str):
+    # other transports, e.g. mocked ones, have no connections limit per host
+    if isinstance(client._transport, CheckerConnectionPool):
+        async with client._transport.host_slot(url):
+            yield
+    else:
+        yield
+
+
+def mark(name):
+    marks = request_marks.get()
+    if marks is None:
+        return
+    if name == "acquired":
+        # marks of previous request of the same fetch, e.g. rejected HEAD before GET fallback
+        for stale in ("resolved", "connected", "tls", "headers"):
+            marks.pop(stale, None)
+    marks[name] = time.perf_counter()
+
+
+@contextlib.contextmanager
+def timed_request():
+    # marks are collected by connection pool and backend of checker client in the same task
+    marks = {"start": time.perf_counter()}
+    token = request_marks.set(marks)
+    try:
+        yield marks
+    finally:
+        request_marks.reset(token)
+
+
+def timing_phases(marks: Dict[str, float]) -> Optional[Dict[str, float]]:
+    # queue is wait for connection slots in our process (host slot of check is taken before its
+    # start), dns, connect and tls are measured for new connections only, ttfb is from connection
+    # ready till response headers
+    phases = {}
+    if "acquired" in marks:
+        phases["queue"] = marks["acquired"] - marks["start"]
+        ready = marks["acquired"]
+        for phase, start, end in (
+            ("dns", "acquired", "resolved"),
+            ("connect", "resolved", "connected"),
+            ("tls", "connected", "tls"),
+        ):
+            if start in marks and end in marks:
+                phases[phase] = marks[end] - marks[start]
+                ready = marks[end]
+        if "headers" in marks:
+            phases["ttfb"] = marks["headers"] - ready
+    if "headers" in marks and "end" in marks:
+        phases["download"] = marks["end"] - marks["headers"]
+    return phases or None
+
+
+class TimingBackend(AsyncioBackend):
+    """Asyncio backend which resolves, connects and starts tls as separate steps to time them."""
+
+    async def open_tcp_stream(self, hostname, port, ssl_context, timeout, *, local_address):
+        loop = asyncio.get_event_loop()
+        connect_timeout = timeout.get("connect")
+        local_addr = None if local_address is None else (local_address, 0)
+        try:
+            addresses = await asyncio.wait_for(
+                loop.getaddrinfo(hostname.decode("ascii"), port, type=socket.SOCK_STREAM), connect_timeout
+            )
+            mark("resolved")
+            error = OSError(f"no addresses for host: {hostname.decode('ascii')}")
+            for *_, address in addresses:
+                try:
+                    stream_reader, stream_writer = await asyncio.wait_for(
+                        asyncio.open_connection(address[0], address[1], local_addr=local_addr), connect_timeout
+                    )
+                    break
+                except OSError as err:
+                    error = err
+            else:
+                raise error
+            mark("connected")
+            stream = SocketStream(stream_reader=stream_reader, stream_writer=stream_writer)
+            if ssl_context is not None:
+                stream = await stream.start_tls(hostname, ssl_context, timeout)
+                mark("tls")
+            return stream
+        except asyncio.TimeoutError as err:
+            raise httpcore.ConnectTimeout(err) from err
+        except OSError as err:
+            raise httpcore.ConnectError(err) from err
+
+
+class HostLimitedByteStream(httpcore.AsyncByteStream):
+    def __init__(self, stream: httpcore.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class CheckerConnectionPool(httpcore.AsyncConnectionPool):
+    """Connection pool with connections limit per host, connection reuse stats and request timing marks.
+
+    `stats` counts `hits` for requests sent over already opened connection and `misses` for
+    requests which opened new connection.
+    """
+
+    def __init__(self, *, max_connections_per_host=None, **kwargs):
+        super().__init__(**kwargs)
+        self._max_connections_per_host = max_connections_per_host
+        self._host_semaphores = {}  # origin -> (semaphore, users), removed when not used
+        self.stats = Counter()
+
+    @contextlib.asynccontextmanager
+    async def host_slot(self, url: str):
+        # check waits for connection slot of host before its clock starts and requests of the check
+        # use the slot, so wait for busy host isn't counted to check duration or failed by timeout
+        raw_url = httpx.URL(url).raw
+        if self._max_connections_per_host is None or raw_url[0] not in (b"http", b"https") or not raw_url[1]:
+            yield
+            return
+        origin = url_to_origin(raw_url)
+        await self._acquire_host(origin, None)
+        token = held_hosts.set(held_hosts.get() + (origin,))
+        try:
+            yield
+        finally:
+            held_hosts.reset(token)
+            self._release_host(origin)
+
+    async def arequest(self, method, url, headers=None, stream=None, ext=None):
+        if self._max_connections_per_host is None or url_to_origin(url) in held_hosts.get():
+            response = await super().arequest(method, url, headers=headers, stream=stream, ext=ext)
+            mark("headers")
+            return response
+
+        origin = url_to_origin(url)
+        await self._acquire_host(origin, (ext or {}).get("timeout", {}).get("pool"))
+        try:
+            status_code, headers, stream, ext = await super().arequest(
+                method, url, headers=headers, stream=stream, ext=ext
+            )
+        except BaseException:
+            self._release_host(origin)
+            raise
+        mark("headers")
+        # host connection is busy until response is read or closed
+        return status_code, headers, HostLimitedByteStream(stream, lambda: self._release_host(origin)), ext
+
+    async def _get_connection_from_pool(self, origin):
+        connection = await super()._get_connection_from_pool(origin)
+        self.stats["hits" if connection is not None else "misses"] += 1
+        metrics.HTTP_CONNECTIONS.labels("hit" if connection is not None else "miss").inc()
+        if connection is not None:
+            mark("acquired")
+        return connection
+
+    async def _add_to_pool(self, connection, timeout):
+        await super()._add_to_pool(connection, timeout)
+        mark("acquired")
+
+    async def _acquire_host(self, origin, timeout):
+        semaphore, users = self._host_semaphores.get(origin) or (asyncio.Semaphore(self._max_connections_per_host), 0)
+        self._host_semaphores[origin] = (semaphore, users + 1)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self._forget_host(origin)
+            raise httpcore.PoolTimeout(f"no free connection for host: {origin[1].decode('ascii')}")
+        except BaseException:
+            self._forget_host(origin)
+            raise
+
+    def _release_host(self, origin):
+        semaphore, _ = self._host_semaphores[origin]
+        semaphore.release()
+        self._forget_host(origin)
+
+    def _forget_host(self, origin):
+        semaphore, users = self._host_semaphores[origin]
+        if users == 1:
+            del self._host_semaphores[origin]
+        else:
+            self._host_semaphores[origin] = (semaphore, users - 1)
@@ -1,27 +1,53 @@
+import asyncio
 import logging
+import time
+import zlib
+from collections import Counter
 from functools import partial
 
 import arq
-import httpx
 
-from service import config
+from service import config, logs, metrics
 from service.db import (
     postgres_cursor,
     SiteCheckPgManager,
     EventPgManager,
+    SiteStatusPgManager,
+    MinuteRollupPgManager,
+    HourRollupPgManager,
     postgres_pool_factory,
     ensure_db_configured,
+    maintain_events_partitions,
 )
 from service.entities import Event
+from service.http_client import connection_stats, host_slot, http_client_factory
 from service.kafka import (
+    delivery_stats as kafka_delivery_stats,
     put_results_to_kafka,
     kafka_producer_factory,
+    replay_spool,
     kafka_consumer_factory,
+    report_consumer_lag,
+)
+from service.rollups import aggregate_rollups
+from service.spool import Spool
+from service.utils import (
+    AdaptiveLimiter,
+    ChecksCache,
+    fetch,
+    fetch_and_check,
+    fetch_conditional,
+    fetch_head,
+    patterns_check,
+    regexp_check,
+    schedule_jitter,
 )
-from service.utils import fetch, regexp_check
 
 
 logger = logging.getLogger()
+# per item lines of hot path are sampled, summaries of all items are logged periodically
+checks_summary = logs.Summary("checked sites", config.LOG_SUMMARY_INTERVAL)
+transfer_summary = logs.Summary("transferred events", config.LOG_SUMMARY_INTERVAL)
 
 
 async def redis_pool_factory(config):
@@ -29,32 +55,209 @@ async def redis_pool_factory(config):
 
 
 async def availability_check(ctx, site_check):
-    logger.info("start site availability check for url: %s", site_check.url)
     http_client = ctx["http_client"]
     kafka_producer = ctx["kafka_producer"]
-    check_result, content = await fetch(http_client, site_check.url)
-    check_result.regexp_found = regexp_check(site_check.regexp, content)
-    await put_results_to_kafka(kafka_producer, check_result)
-    logger.info("finished site availability check for url: %s", site_check.url)
+    with metrics.CHECKS_IN_FLIGHT.track_inprogress():
+        # host slot is taken first, so check waiting for busy host doesn't hold concurrency slot
+        async with host_slot(http_client, site_check.url), ctx["concurrency_limiter"].slot():
+            if site_check.regexp is None and not site_check.patterns and config.FETCH_HEAD_ONLY:
+                check_result = await fetch_head(http_client, site_check.url)
+            elif config.FETCH_CONDITIONAL:
+                check_result = await fetch_conditional(
+                    http_client, ctx["checks_cache"], site_check.url, site_check.regexp, site_check.patterns
+                )
+            elif config.FETCH_STREAMING:
+                check_result = await fetch_and_check(
+                    http_client, site_check.url, site_check.regexp, site_check.patterns
+                )
+            else:
+                check_result, content = await fetch(http_client, site_check.url)
+                check_result.regexp_found = regexp_check(site_check.regexp, content)
+                check_result.patterns_found = patterns_check(site_check.patterns, content)
+            ctx["concurrency_limiter"].observe(check_result.duration)
+        outcome = metrics.fetch_outcome(check_result)
+        metrics.FETCH_DURATION.labels(outcome).observe(check_result.duration)
+        await put_results_to_kafka(kafka_producer, check_result, ctx.get("spool"))
+    checks_summary.add(outcome)
+    logger.info("finished site availability check for url: %s", site_check.url, extra=logs.SAMPLED)
+
+
+async def availability_check_batch(ctx, site_checks):
+    # checks of one batch share single job slot, so they are run concurrently inside of it, sites
+    # guards are released after checks, so sites can be scheduled in other batches again
+    checks = [asyncio.ensure_future(availability_check(ctx, site_check)) for site_check in site_checks]
+    try:
+        results = await asyncio.gather(*checks, return_exceptions=True)
+    except asyncio.CancelledError:
+        # job timeout or worker shutdown, not finished checks are lost till next schedule of sites
+        unfinished = [site_check.url for site_check, check in zip(site_checks, checks) if check.cancelled()]
+        logger.warning("cancelled availability checks batch, unfinished checks: %s %s", len(unfinished), unfinished)
+        raise
+    finally:
+        await ctx["redis_pool"].delete(*(site_guard_key(site_check) for site_check in site_checks))
+    for site_check, result in zip(site_checks, results):
+        if isinstance(result, Exception):
+            logger.error("failed site availability check for url: %s", site_check.url, exc_info=result)
+
+
+async def enqueue_availability_checks(redis, site_checks, batch_size=1, jitter_window=0, high_water=0):
+    # job id is deterministic per site (batch sites have guard key per site), so site isn't queued
+    # again while previous check is queued or running, not started check expires when next one is
+    # due, sites above queue high water mark are skipped till next interval
+    count = 0
+    jobs = 0
+    taken = 0
+    skipped = Counter()
+    try:
+        free = None
+        if high_water:
+            # queue is sorted set of jobs, it includes checks deferred by jitter
+            free = high_water - await redis.zcard(AvailabilityCheckerWorkerSettings.queue_name)
+        batches = {}  # jitter second -> sites, so sites of batch have close jitter
+        async for site_check in site_checks:
+            taken += 1
+            defer_by = schedule_jitter(site_check.url, min(jitter_window, site_check.interval))
+            # site joins to already counted batch job or needs new job
+            new_job = batch_size == 1 or int(defer_by) not in batches
+            if free is not None and jobs + len(batches) + new_job > free:
+                skipped["backpressure"] += 1
+                continue
+            if batch_size == 1:
+                job = await redis.enqueue_job(
+                    availability_check.__name__,
+                    site_check,
+                    _job_id=f"{availability_check.__name__}:{site_job_key(site_check)}",
+                    _queue_name=AvailabilityCheckerWorkerSettings.queue_name,
+                    _defer_by=defer_by,
+                    _expires=defer_by + site_check.interval,
+                )
+                if job is None:
+                    skipped["duplicate"] += 1
+                    continue
+                logger.info("scheduled site availability for url: %s", site_check.url, extra=logs.SAMPLED)
+                count += 1
+                jobs += 1
+                continue
+            batch = batches.setdefault(int(defer_by), [])
+            batch.append(site_check)
+            if len(batch) >= batch_size:
+                count += await enqueue_availability_checks_batch(
+                    redis, batches.pop(int(defer_by)), int(defer_by), skipped
+                )
+                jobs += 1
+        for defer_by, batch in batches.items():
+            count += await enqueue_availability_checks_batch(redis, batch, defer_by, skipped)
+    except Exception:
+        # claimed sites aren't due again till their next check time, so taken but not queued sites
+        # are lost for interval, sites not taken from claimed ones are unclaimed by their reader
+        skipped["error"] += taken - count - sum(skipped.values())
+        if hasattr(site_checks, "aclose"):
+            await site_checks.aclose()
+        raise
+    finally:
+        for reason, skipped_count in skipped.items():
+            metrics.SKIPPED_CHECKS.labels(reason).inc(skipped_count)
+        if skipped:
+            logger.warning("skipped site availability checks: %s", dict(skipped))
+    return count
+
+
+async def enqueue_availability_checks_batch(redis, site_checks, defer_by=0, skipped=None):
+    # batch job id depends on batch sites, so it deduplicates the same batch only, every site is
+    # guarded by own key till its check is done or not started check expires
+    expires = defer_by + min(site_check.interval for site_check in site_checks)
+    claimed = await claim_sites(redis, site_checks, expires)
+    if skipped is not None:
+        skipped["duplicate"] += len(site_checks) - len(claimed)
+    if not claimed:
+        return 0
+    sites_key = zlib.crc32(",".join(str(site_job_key(site_check)) for site_check in claimed).encode("utf8"))
+    job = await redis.enqueue_job(
+        availability_check_batch.__name__,
+        claimed,
+        _job_id=f"{availability_check_batch.__name__}:{defer_by}:{sites_key:08x}",
+        _queue_name=AvailabilityCheckerWorkerSettings.queue_name,
+        _defer_by=defer_by,
+        _expires=expires,
+    )
+    if job is None:
+        await redis.delete(*(site_guard_key(site_check) for site_check in claimed))
+        if skipped is not None:
+            skipped["duplicate"] += len(claimed)
+        return 0
+    logger.info("scheduled site availability batch for urls count: %s", len(claimed), extra=logs.SAMPLED)
+    return len(claimed)
+
+
+async def claim_sites(redis, site_checks, expires):
+    # guard keys are set concurrently, so redis client sends them without waiting every reply
+    claimed = await asyncio.gather(
+        *(
+            redis.set(site_guard_key(site_check), 1, pexpire=int(expires * 1000), exist=redis.SET_IF_NOT_EXIST)
+            for site_check in site_checks
+        )
+    )
+    return [site_check for site_check, ok in zip(site_checks, claimed) if ok]
+
+
+def site_guard_key(site_check):
+    return f"{availability_check_batch.__name__}:site:{site_job_key(site_check)}"
+
+
+def site_job_key(site_check):
+    return site_check.id if site_check.id is not None else site_check.url
 
 
 async def schedule_availability_checks(ctx):
     logger.info("start availability checks scheduling")
+    start = time.perf_counter()
     postgres_pool = ctx["pg_pool"]
     redis = ctx["redis_pool"]
-    count = 0
     async with postgres_cursor(postgres_pool) as cursor:
-        async for site_check in SiteCheckPgManager(cursor).get_all():
-            await redis.enqueue_job(
-                availability_check.__name__, site_check, _queue_name=AvailabilityCheckerWorkerSettings.queue_name
-            )
-            logger.info("scheduled site availability for url: %s", site_check.url)
-            count += 1
-    logger.info("finished availability checks scheduling count: %s", count)
+        count = await enqueue_availability_checks(
+            redis,
+            SiteCheckPgManager(cursor).claim_due(shard=config.SCHEDULER_SHARD, shards=config.SCHEDULER_SHARDS),
+            batch_size=config.SCHEDULE_BATCH_SIZE,
+            jitter_window=config.SCHEDULE_JITTER_WINDOW,
+            high_water=config.SCHEDULE_QUEUE_HIGH_WATER,
+        )
+    duration = time.perf_counter() - start
+    metrics.SCHEDULE_TICK_DURATION.observe(duration)
+    metrics.SCHEDULE_TICK_SITES.set(count)
+    metrics.SCHEDULED_SITES.inc(count)
+    logger.info(
+        "finished availability checks scheduling: scheduled %s sites in %.1fs",
+        count,
+        duration,
+        extra={"scheduled": count, "duration": duration},
+    )
+    return count
+
+
+async def write_events(cursor, messages):
+    metrics.TRANSFER_BATCH_SIZE.observe(len(messages))
+    start = time.perf_counter()
+    await cursor.execute("BEGIN")
+    try:
+        # assume we don't need to avoid duplicated records can be appeared in postgres
+        # for at least one delivery, however it can be avoided with upsert usage
+        events = await EventPgManager(cursor).create_many([Event.deserialize(msg.value) for msg in messages])
+        await SiteStatusPgManager(cursor).upsert_many(events)
+        for rollup_manager in (MinuteRollupPgManager(cursor), HourRollupPgManager(cursor)):
+            await rollup_manager.upsert_many(aggregate_rollups(events, rollup_manager.resolution))
+    except BaseException:
+        await cursor.execute("ROLLBACK")
+        raise
+    await cursor.execute("COMMIT")
+    metrics.PG_INSERT_DURATION.observe(time.perf_counter() - start)
+    transfer_summary.add(count=len(events))
+    logger.info("transferred site availability count: %s", len(events), extra=logs.SAMPLED)
+    return events
 
 
 async def kafka_to_pg_transfer(ctx):
     logger.info("start kafka to postgres transfer")
+    start = time.perf_counter()
     postgres_pool = ctx["pg_pool"]
     kafka_consumer = ctx["kafka_consumer"]
     count = 0
@@ -66,21 +269,24 @@ async def kafka_to_pg_transfer(ctx):
                 timeout_ms=config.KAFKA_CONSUMER_WAIT_TIMEOUT, max_records=config.KAFKA_CONSUMER_MAX_RECORDS
             )
             for tp, messages in result.items():
-                await cursor.execute("BEGIN")
-                for msg in messages:
-                    # assume we don't need to avoid duplicated records can be appeared in postgres
-                    # for at least one delivery, however it can be avoided with upsert usage
-                    event = await EventPgManager(cursor).create(
-                        **{k: v for k, v in Event.deserialize(msg.value).__dict__.items() if k != "id"}
-                    )
-                    logger.info("transferred site availability for url: %s", event.url)
-                await cursor.execute("COMMIT")
+                report_consumer_lag(kafka_consumer, tp, messages)
+                await write_events(cursor, messages)
                 await kafka_consumer.commit({tp: messages[-1].offset + 1})
-                committed += 1
+                committed += len(messages)
             if committed == 0:
                 break
             count += committed
-    logger.info("finished kafka to postgres transfer count: %s", count)
+    duration = time.perf_counter() - start
+    logger.info(
+        "finished kafka to postgres transfer: transferred %s events in %.1fs",
+        count,
+        duration,
+        extra={"transferred": count, "duration": duration},
+    )
+
+
+async def events_maintenance(ctx):
+    await maintain_events_partitions(ctx["pg_pool"])
 
 
 async def startup(
@@ -90,9 +296,22 @@ async def startup(
     redis=False,
     kafka_producer=False,
     kafka_consumer=False,
+    metrics_server=False,
+    spool=False,
 ):
+    if metrics_server:
+        metrics.start_metrics_server(config.METRICS_PORT)
     if http:
-        ctx["http_client"] = httpx.AsyncClient()
+        ctx["http_client"] = http_client_factory(config.HTTP_CLIENT_CONFIG)
+        ctx["checks_cache"] = ChecksCache(config.FETCH_CONDITIONAL_CACHE_SIZE)
+        ctx["concurrency_limiter"] = AdaptiveLimiter(
+            min(config.AVAILABILITY_CHECKER_MIN_JOBS, config.AVAILABILITY_CHECKER_MAX_JOBS),
+            config.AVAILABILITY_CHECKER_MAX_JOBS,
+            lag_threshold=config.CHECKER_LAG_THRESHOLD,
+            latency_inflation=config.CHECKER_LATENCY_INFLATION,
+        )
+        ctx["lag_monitor"] = asyncio.ensure_future(ctx["concurrency_limiter"].monitor_lag())
+        metrics.CHECKS_MAX_JOBS.set(config.AVAILABILITY_CHECKER_MAX_JOBS)
     if postgres:
         ctx["pg_pool"] = await postgres_pool_factory(config.POSTGRES_CONFIG)
         await ensure_db_configured(ctx["pg_pool"])
@@ -100,19 +319,36 @@ async def startup(
         ctx["redis_pool"] = await redis_pool_factory(config.REDIS_CONFIG)
     if kafka_producer:
         ctx["kafka_producer"] = await kafka_producer_factory(config.KAFKA_PRODUCER_CONFIG)
+    if spool and config.KAFKA_SPOOL_PATH:
+        ctx["spool"] = Spool(config.KAFKA_SPOOL_PATH, config.KAFKA_SPOOL_SEGMENT_SIZE, config.KAFKA_SPOOL_MAX_SIZE)
+        ctx["spool_replay"] = asyncio.ensure_future(replay_spool(ctx["kafka_producer"], ctx["spool"]))
     if kafka_consumer:
         ctx["kafka_consumer"] = await kafka_consumer_factory(config.KAFKA_TOPIC, config.KAFKA_CONSUMER_CONFIG)
 
 
 async def shutdown(ctx):
+    checks_summary.flush()
+    transfer_summary.flush()
+    if "lag_monitor" in ctx:
+        ctx["lag_monitor"].cancel()
+    if "spool_replay" in ctx:
+        ctx["spool_replay"].cancel()
     if "http_client" in ctx:
         await ctx["http_client"].aclose()
+        logger.info("http connections reuse stats: %s", connection_stats(ctx["http_client"]))
     if "pg_pool" in ctx:
         ctx["pg_pool"].close()
     if "redis_pool" in ctx:
         ctx["redis_pool"].close()
     if "kafka_producer" in ctx:
+        # deliver events buffered for linger time before stop
+        await ctx["kafka_producer"].flush()
         await ctx["kafka_producer"].stop()
+        logger.info("kafka producer delivery stats: %s", dict(kafka_delivery_stats))
+    if "spool" in ctx:
+        # not replayed events are replayed after restart, failed background deliveries are spooled
+        # till producer stop
+        ctx["spool"].close()
     if "kafka_consumer" in ctx:
         await ctx["kafka_consumer"].stop()
 
@@ -120,28 +356,47 @@ async def shutdown(ctx):
 class AvailabilityCheckerWorkerSettings:
     redis_settings = arq.connections.RedisSettings(**config.REDIS_CONFIG)
     queue_name = "arq:queue:availability_check"
-    max_jobs = config.AVAILABILITY_CHECKER_MAX_JOBS
+    max_jobs = config.AVAILABILITY_CHECKER_MAX_JOBS  # upper bound of adaptive checks concurrency limit
     retry_jobs = False  # assume we can ignore failed checks and reschedule it next time
-    on_startup = partial(startup, http=True, redis=True, kafka_producer=True)
+    keep_result = 0  # result key would block enqueue of the next check of site with the same job id
+    on_startup = partial(startup, http=True, redis=True, kafka_producer=True, metrics_server=True, spool=True)
     on_shutdown = shutdown
-    functions = [availability_check]
+    # batch checks run concurrently in one job, so its timeout is sized by batch size
+    functions = [
+        availability_check,
+        arq.func(availability_check_batch, timeout=config.AVAILABILITY_CHECK_BATCH_TIMEOUT),
+    ]
 
 
 class CheckSchedulerWorkerSettings:
     redis_settings = arq.connections.RedisSettings(**config.REDIS_CONFIG)
-    queue_name = "arq:queue:check_scheduler"
-    on_startup = partial(startup, postgres=True, redis=True)
+    # every shard has own queue and cron job name, so ticks of shards aren't deduplicated together
+    # and aren't run by scheduler of other shard
+    shard_suffix = f":{config.SCHEDULER_SHARD}" if config.SCHEDULER_SHARDS > 1 else ""
+    queue_name = f"arq:queue:check_scheduler{shard_suffix}"
+    on_startup = partial(startup, postgres=True, redis=True, metrics_server=True)
     on_shutdown = shutdown
-    # assume we don't need to parallelize scheduling, can sacrifice redundancy and assume workers
-    # handle checks faster than queue grows to keep current implementation more simple
-    cron_jobs = [arq.cron(schedule_availability_checks, unique=True, minute={i for i in range(60)})]
+    # every tick schedules only sites which are due by their own check interval, scheduling is
+    # scaled horizontally by shards
+    cron_jobs = [
+        arq.cron(
+            schedule_availability_checks,
+            name=f"cron:{schedule_availability_checks.__name__}{shard_suffix}",
+            unique=True,
+            minute={i for i in range(60)},
+        )
+    ]
 
 
 class KafkaToPostgresTransferWorkerSettings:
     redis_settings = arq.connections.RedisSettings(**config.REDIS_CONFIG)
     queue_name = "arq:queue:kafka_to_postgres_transfer"
-    on_startup = partial(startup, postgres=True, kafka_consumer=True)
+    on_startup = partial(startup, postgres=True, kafka_consumer=True, metrics_server=True)
     on_shutdown = shutdown
     # in general this job can be run in parallel, but it require more efforts to rewrite runner
-    # so sorry if you see this ugly approach with cron unique job and infinite loop inside
-    cron_jobs = [arq.cron(kafka_to_pg_transfer, unique=True, minute={i for i in range(60)})]
+    # so sorry if you see this ugly approach with cron unique job and infinite loop inside,
+    # see service.transfer for long running partitions parallel alternative
+    cron_jobs = [
+        arq.cron(kafka_to_pg_transfer, unique=True, minute={i for i in range(60)}),
+        arq.cron(events_maintenance, unique=True, minute=0),
+    ]
@@ -1,8 +1,21 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from functools import partial
+
 import aiokafka
+from aiokafka.errors import KafkaError
 from aiokafka.helpers import create_ssl_context
 
-from service import config
+from service import config, metrics
 from service.entities import Event
+from service.spool import Spool
+
+
+logger = logging.getLogger()
+
+delivery_stats = Counter()
 
 
 async def kafka_producer_factory(config):
@@ -13,13 +26,109 @@ async def kafka_producer_factory(config):
     return producer
 
 
-async def kafka_consumer_factory(topic, config):
+async def kafka_consumer_factory(topic, config, listener=None):
     if config["ssl_context"]:
         config = dict(config, ssl_context=create_ssl_context(**config["ssl_context"]))
-    consumer = aiokafka.AIOKafkaConsumer(topic, **config)
+    consumer = aiokafka.AIOKafkaConsumer(**config)
+    consumer.subscribe([topic], listener=listener)
     await consumer.start()
     return consumer
 
 
-async def put_results_to_kafka(producer: aiokafka.AIOKafkaProducer, event: Event):
-    await producer.send_and_wait(config.KAFKA_TOPIC, event.serialize())
+async def put_results_to_kafka(producer: aiokafka.AIOKafkaProducer, event: Event, spool: Spool = None):
+    value = event.serialize(binary=config.KAFKA_EVENT_FORMAT == "binary")
+    if spool is not None:
+        await put_to_kafka_or_spool(producer, spool, value)
+        return
+    start = time.perf_counter()
+    if config.KAFKA_PRODUCER_WAIT_DELIVERY:
+        await producer.send_and_wait(config.KAFKA_TOPIC, value)
+        metrics.KAFKA_PRODUCE_DURATION.observe(time.perf_counter() - start)
+        delivery_stats["delivered"] += 1
+        return
+    # send only puts event to producer batch (or waits free space in buffer), batch is delivered
+    # in background after linger time, so check doesn't wait broker round trip
+    delivery = await producer.send(config.KAFKA_TOPIC, value)
+    delivery.add_done_callback(partial(report_delivery, start))
+
+
+async def put_to_kafka_or_spool(producer: aiokafka.AIOKafkaProducer, spool: Spool, value: bytes):
+    # new events skip kafka while spooled ones aren't replayed, so kafka gets events in order
+    if not spool.pending:
+        start = time.perf_counter()
+        try:
+            delivery = await asyncio.wait_for(send(producer, value), config.KAFKA_SPOOL_TIMEOUT)
+        except (asyncio.TimeoutError, KafkaError):
+            # event can be delivered later by producer too, so it's at least once delivery
+            pass
+        else:
+            if config.KAFKA_PRODUCER_WAIT_DELIVERY:
+                report_delivery(start, delivery)
+            else:
+                delivery.add_done_callback(partial(report_delivery, start, spool=spool, value=value))
+            return
+    spool_event(spool, value)
+
+
+async def send(producer, value):
+    delivery = await producer.send(config.KAFKA_TOPIC, value)
+    if config.KAFKA_PRODUCER_WAIT_DELIVERY:
+        # timeout cancels wait only, not event delivery
+        await asyncio.shield(delivery)
+    return delivery
+
+
+def spool_event(spool, value):
+    was_full = spool.full
+    if spool.append(value):
+        metrics.SPOOLED_EVENTS.set(spool.pending)
+        delivery_stats["spooled"] += 1
+        return
+    if not was_full:
+        logger.error("events spool is full, events are dropped till replay frees space")
+    metrics.SPOOL_DROPPED_EVENTS.inc()
+    delivery_stats["dropped"] += 1
+
+
+async def replay_spool(producer: aiokafka.AIOKafkaProducer, spool: Spool):
+    # spooled events are sent in batches, batch is committed when all its events are delivered,
+    # failed batch is sent again after interval
+    while True:
+        try:
+            values = spool.read(config.KAFKA_SPOOL_REPLAY_BATCH)
+            if values:
+                deliveries = [await producer.send(config.KAFKA_TOPIC, value) for value in values]
+                await asyncio.gather(*deliveries)
+                spool.commit(len(values))
+        except KafkaError as e:
+            logger.warning("failed spooled events replay to kafka: %r", e)
+            values = None
+        except Exception:
+            # e.g. disk error of spool, replay doesn't stop, so spooled events aren't left till spool
+            # is full
+            logger.exception("failed spooled events replay")
+            values = None
+        if not values:
+            await asyncio.sleep(config.KAFKA_SPOOL_REPLAY_INTERVAL)
+            continue
+        metrics.SPOOLED_EVENTS.set(spool.pending)
+        delivery_stats["replayed"] += len(values)
+        logger.info("replayed spooled events to kafka count: %s, left: %s", len(values), spool.pending)
+
+
+def report_delivery(start, delivery, spool=None, value=None):
+    if delivery.cancelled() or delivery.exception() is not None:
+        delivery_stats["failed"] += 1
+        logger.error("failed to deliver event to kafka: %r", None if delivery.cancelled() else delivery.exception())
+        if spool is not None:
+            spool_event(spool, value)
+    else:
+        metrics.KAFKA_PRODUCE_DURATION.observe(time.perf_counter() - start)
+        delivery_stats["delivered"] += 1
+
+
+def report_consumer_lag(consumer: aiokafka.AIOKafkaConsumer, tp, messages):
+    # high water is the last known offset of partition, it's unknown till the first fetch
+    highwater = consumer.highwater(tp)
+    if highwater is not None:
+        metrics.KAFKA_CONSUMER_LAG.labels(tp.partition).set(highwater - messages[-1].offset - 1)
@@ -0,0 +1,75 @@
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+
+logger = logging.getLogger()
+
+# checker
+FETCH_DURATION = Histogram(
+    "site_checker_fetch_duration_seconds",
+    "Site fetch duration by outcome: ok, http_error (4xx and 5xx status) or network_error",
+    ["outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+CHECKS_IN_FLIGHT = Gauge("site_checker_checks_in_flight", "Availability checks running in worker process")
+CHECKS_MAX_JOBS = Gauge("site_checker_checks_max_jobs", "Availability check jobs limit of worker process")
+CHECKS_CONCURRENCY_LIMIT = Gauge(
+    "site_checker_checks_concurrency_limit", "Adaptive limit of availability checks running in worker process"
+)
+EVENT_LOOP_LAG = Gauge("site_checker_event_loop_lag_seconds", "Delay of event loop timer callback")
+KAFKA_PRODUCE_DURATION = Histogram(
+    "site_checker_kafka_produce_duration_seconds",
+    "Duration from event send to its delivery to kafka",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+HTTP_CONNECTIONS = Counter(
+    "site_checker_http_connections",
+    "Connections taken by checker requests: hit (reused keep alive connection) or miss (new connection)",
+    ["result"],
+)
+SPOOLED_EVENTS = Gauge("site_checker_spooled_events", "Events in local spool waiting replay to kafka")
+SPOOL_DROPPED_EVENTS = Counter("site_checker_spool_dropped_events", "Events dropped because local spool is full")
+# scheduler
+SCHEDULE_TICK_DURATION = Histogram(
+    "site_checker_schedule_tick_duration_seconds",
+    "Duration of scheduler tick",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+SCHEDULE_TICK_SITES = Gauge("site_checker_schedule_tick_sites", "Sites scheduled by the last scheduler tick")
+SCHEDULED_SITES = Counter("site_checker_scheduled_sites", "Sites scheduled for availability check")
+SKIPPED_CHECKS = Counter(
+    "site_checker_skipped_checks",
+    "Due sites not scheduled by reason: duplicate (previous check is queued or running), backpressure or error",
+    ["reason"],
+)
+# transfer
+KAFKA_CONSUMER_LAG = Gauge(
+    "site_checker_kafka_consumer_lag", "Not transferred events of partition after fetched batch", ["partition"]
+)
+TRANSFER_BATCH_SIZE = Histogram(
+    "site_checker_transfer_batch_size",
+    "Events per batch written to postgres",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+PG_INSERT_DURATION = Histogram(
+    "site_checker_pg_insert_duration_seconds",
+    "Duration of events batch write transaction",
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def fetch_outcome(event):
+    if event.status_code is None:
+        return "network_error"
+    if event.status_code >= 400:
+        return "http_error"
+    return "ok"
+
+
+def start_metrics_server(port):
+    # metrics are served from daemon thread of worker process, 0 port disables endpoint
+    if not port:
+        return
+    start_http_server(port)
+    logger.info("metrics endpoint started on port: %s", port)
@@ -0,0 +1,66 @@
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from service.entities import Event, Rollup
+
+# latency sketch is log scale histogram of durations in milliseconds, quantiles computed from it
+# have relative error below (gamma - 1) / 2, sketches are merged by adding counts of buckets
+LATENCY_SKETCH_GAMMA = 1.1
+LATENCY_SKETCH_MAX_BUCKET = 127  # ~183 seconds, longer durations are counted in the last bucket
+
+MINUTE = "minute"
+HOUR = "hour"
+
+
+def latency_bucket(duration: float) -> int:
+    milliseconds = duration * 1000
+    if milliseconds <= 1:
+        return 0
+    return min(math.ceil(math.log(milliseconds, LATENCY_SKETCH_GAMMA)), LATENCY_SKETCH_MAX_BUCKET)
+
+
+def merge_sketches(*sketches: Dict[int, int]) -> Dict[int, int]:
+    merged = {}
+    for sketch in sketches:
+        for bucket, count in sketch.items():
+            merged[bucket] = merged.get(bucket, 0) + count
+    return merged
+
+
+def sketch_quantile(sketch: Dict[int, int], quantile: float) -> float:
+    # duration in seconds at the middle of the bucket where quantile rank is reached
+    rank = quantile * (sum(sketch.values()) - 1)
+    seen = 0
+    for bucket in sorted(sketch):
+        seen += sketch[bucket]
+        if seen > rank:
+            if bucket == 0:
+                return 0.001
+            return 2 * LATENCY_SKETCH_GAMMA ** bucket / (LATENCY_SKETCH_GAMMA + 1) / 1000
+    raise ValueError("empty sketch")
+
+
+def rollup_bucket(created_at: datetime, resolution: str) -> datetime:
+    if resolution == MINUTE:
+        return created_at.replace(second=0, microsecond=0)
+    return created_at.replace(minute=0, second=0, microsecond=0)
+
+
+def aggregate_rollups(events: Iterable[Event], resolution: str) -> List[Rollup]:
+    rollups = {}
+    for event in events:
+        key = (event.url, rollup_bucket(event.created_at, resolution))
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = Rollup(*key, 0, 0, 0, event.duration, event.duration, 0, {})
+        rollup.count += 1
+        rollup.failures += event.status_code is None or event.status_code >= 400
+        rollup.regexp_misses += event.regexp_found is False or False in (event.patterns_found or {}).values()
+        rollup.duration_min = min(rollup.duration_min, event.duration)
+        rollup.duration_max = max(rollup.duration_max, event.duration)
+        rollup.duration_sum += event.duration
+        bucket = latency_bucket(event.duration)
+        rollup.latency_sketch[bucket] = rollup.latency_sketch.get(bucket, 0) + 1
+    # sorted to upsert rows in the same order from concurrent transactions and avoid deadlocks
+    return sorted(rollups.values(), key=lambda r: (r.url, r.bucket))
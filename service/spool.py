@@ -0,0 +1,127 @@
+"""Append only local spool of serialized events on disk.
+
+Spool is directory of preallocated memory mapped segment files, records are appended to the last
+segment as `<I` length and payload and are read from the first one, fully read segments are
+removed. Record length is written after payload, so zero length marks end of written records of
+segment after restart. Read position isn't persisted, so records of partially read segment are
+read again after restart.
+"""
+import mmap
+import os
+import struct
+from collections import deque
+
+
+RECORD_HEADER = struct.Struct("<I")
+SEGMENT_SUFFIX = ".spool"
+
+
+class Segment:
+    def __init__(self, path, size):
+        self.path = path
+        # existing segment keeps its size, segment size setting can be changed between restarts
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.size = os.path.getsize(path) if exists else size
+        self._file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), self.size)
+        self.read_position = 0
+        self.write_position = 0
+        self.records = 0
+        # position after the last written record of existing segment
+        while self.write_position + RECORD_HEADER.size <= self.size:
+            (length,) = RECORD_HEADER.unpack_from(self._map, self.write_position)
+            if not length:
+                break
+            self.write_position += RECORD_HEADER.size + length
+            self.records += 1
+
+    def append(self, value):
+        end = self.write_position + RECORD_HEADER.size + len(value)
+        if end > self.size:
+            return False
+        self._map[self.write_position + RECORD_HEADER.size : end] = value
+        RECORD_HEADER.pack_into(self._map, self.write_position, len(value))
+        self.write_position = end
+        self.records += 1
+        return True
+
+    def read(self, position):
+        # record value and next record position
+        (length,) = RECORD_HEADER.unpack_from(self._map, position)
+        start = position + RECORD_HEADER.size
+        return self._map[start : start + length], start + length
+
+    def skip(self, position):
+        (length,) = RECORD_HEADER.unpack_from(self._map, position)
+        return position + RECORD_HEADER.size + length
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class Spool:
+    """Segmented records log limited by segments count, append fails when log reaches max size."""
+
+    def __init__(self, path, segment_size=16 * 1024 * 1024, max_size=1024 * 1024 * 1024):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max(max_size // segment_size, 1)
+        self.full = False
+        os.makedirs(path, exist_ok=True)
+        names = sorted(name for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+        self._segments = deque(Segment(os.path.join(path, name), segment_size) for name in names)
+        self._sequence = int(names[-1][: -len(SEGMENT_SUFFIX)]) + 1 if names else 0
+        self.pending = sum(segment.records for segment in self._segments)
+
+    def append(self, value):
+        if not self._segments or not self._segments[-1].append(value):
+            if len(self._segments) >= self.max_segments or RECORD_HEADER.size + len(value) > self.segment_size:
+                self.full = True
+                return False
+            self._segments.append(self._new_segment())
+            self._segments[-1].append(value)
+        self.full = False
+        self.pending += 1
+        return True
+
+    def read(self, count):
+        # the oldest not committed records, read position isn't moved till commit
+        values = []
+        for segment in self._segments:
+            position = segment.read_position
+            while position < segment.write_position and len(values) < count:
+                value, position = segment.read(position)
+                values.append(value)
+            if len(values) >= count:
+                break
+        return values
+
+    def commit(self, count):
+        # moves read position after count of read records and removes fully read segments
+        self.pending -= count
+        while count and self._segments:
+            segment = self._segments[0]
+            while count and segment.read_position < segment.write_position:
+                segment.read_position = segment.skip(segment.read_position)
+                count -= 1
+            if segment.read_position >= segment.write_position:
+                # the last segment is removed too when it's read, the next append creates new one
+                self._segments.popleft().remove()
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments.clear()
+
+    def _new_segment(self):
+        segment = Segment(os.path.join(self.path, f"{self._sequence:020d}{SEGMENT_SUFFIX}"), self.segment_size)
+        self._sequence += 1
+        return segment
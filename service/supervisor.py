@@ -0,0 +1,86 @@
+"""Availability check workers supervisor, runs worker process with own event loop per core.
+
+    python -m service.supervisor [processes]
+
+Every process is usual arq worker with the same settings, supervisor forwards SIGINT and SIGTERM to
+all of them, so they stop together, and stops all of them if one exits.
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+
+import arq
+
+from service import config
+
+
+logger = logging.getLogger()
+
+
+def run_checker(index):
+    # imported in worker process to create all clients after spawn, every process serves own
+    # metrics on the next port after metrics port and spools events to own directory, metrics
+    # server is started by worker startup
+    from service.jobs import AvailabilityCheckerWorkerSettings
+
+    if config.METRICS_PORT:
+        config.METRICS_PORT += index
+    if config.KAFKA_SPOOL_PATH:
+        config.KAFKA_SPOOL_PATH = os.path.join(config.KAFKA_SPOOL_PATH, f"checker-{index}")
+    arq.run_worker(AvailabilityCheckerWorkerSettings)
+
+
+class Supervisor:
+    def __init__(self, processes, target=run_checker):
+        context = multiprocessing.get_context("spawn")
+        self._workers = [context.Process(target=target, args=(i,), name=f"checker-{i}") for i in range(processes)]
+        self._stop_deadline = None
+        self._stop_signal = None
+
+    def run(self):
+        for worker in self._workers:
+            worker.start()
+        handlers = {signum: signal.signal(signum, self.stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+        logger.info("started checker processes: %s", len(self._workers))
+        try:
+            self._wait_workers()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        # exit by signal is expected stop, otherwise one of workers failed
+        return 0 if self._stop_signal is not None else 1
+
+    def stop(self, signum=None, frame=None):
+        if self._stop_deadline is not None:
+            return
+        logger.info("stop checker processes on: %s", signal.Signals(signum).name if signum else "worker exit")
+        self._stop_deadline = time.monotonic() + config.CHECKER_PROCESSES_STOP_TIMEOUT
+        self._stop_signal = signum
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    def _wait_workers(self):
+        sentinels = {worker.sentinel: worker for worker in self._workers}
+        while sentinels:
+            timeout = None
+            if self._stop_deadline is not None:
+                timeout = max(self._stop_deadline - time.monotonic(), 0)
+            ready = multiprocessing.connection.wait(list(sentinels), timeout)
+            if not ready and timeout == 0:
+                for worker in sentinels.values():
+                    logger.info("kill not stopped checker process: %s", worker.name)
+                    worker.kill()
+            for sentinel in ready:
+                worker = sentinels.pop(sentinel)
+                worker.join()
+                logger.info("checker process %s exited with code: %s", worker.name, worker.exitcode)
+                self.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(Supervisor(int(sys.argv[1]) if len(sys.argv) > 1 else config.CHECKER_PROCESSES).run())
@@ -0,0 +1,120 @@
+"""Long running kafka to postgres transfer worker.
+
+    python -m service.transfer
+
+Worker is consumer group member, so it scales horizontally up to topic partitions count.
+"""
+import asyncio
+import logging
+import signal
+
+import aiokafka
+
+from service import config, metrics
+from service.db import postgres_cursor, postgres_pool_factory, ensure_db_configured, maintain_events_partitions
+from service.jobs import transfer_summary, write_events
+from service.kafka import kafka_consumer_factory, report_consumer_lag
+
+
+logger = logging.getLogger()
+
+
+class PartitionsTransfer(aiokafka.ConsumerRebalanceListener):
+    """Transfer of assigned partitions with worker task per partition.
+
+    Fetch loop passes every partition batch to its worker and pauses partition till worker writes
+    batch to postgres with its own pool connection and commits partition offset, so partitions are
+    written concurrently and not more than one batch per partition is kept in memory.
+    """
+
+    def __init__(self, pg_pool):
+        self._pg_pool = pg_pool
+        self._consumer = None
+        self._workers = {}  # partition -> (batches queue, worker task)
+
+    async def run(self):
+        self._consumer = await kafka_consumer_factory(config.KAFKA_TOPIC, config.KAFKA_CONSUMER_CONFIG, listener=self)
+        try:
+            while True:
+                result = await self._consumer.getmany(
+                    timeout_ms=config.KAFKA_CONSUMER_WAIT_TIMEOUT, max_records=config.KAFKA_CONSUMER_MAX_RECORDS
+                )
+                for tp, messages in result.items():
+                    if tp not in self._workers:
+                        continue  # partition was revoked after fetch, new owner reads it again
+                    report_consumer_lag(self._consumer, tp, messages)
+                    self._consumer.pause(tp)
+                    self._workers[tp][0].put_nowait(messages)
+        finally:
+            await self._stop_workers(list(self._workers))
+            await self._consumer.stop()
+
+    async def on_partitions_revoked(self, revoked):
+        # fetched batches are written and committed before partitions go to other group member
+        await self._stop_workers(revoked)
+
+    async def on_partitions_assigned(self, assigned):
+        for tp in assigned:
+            if tp not in self._workers:
+                queue = asyncio.Queue()
+                self._workers[tp] = (queue, asyncio.ensure_future(self._transfer_partition(tp, queue)))
+        logger.info("transfer partitions assigned: %s", sorted(tp.partition for tp in self._workers))
+
+    async def _stop_workers(self, partitions):
+        for tp in partitions:
+            if tp not in self._workers:
+                continue
+            queue, task = self._workers.pop(tp)
+            await queue.join()
+            task.cancel()
+
+    async def _transfer_partition(self, tp, queue):
+        while True:
+            messages = await queue.get()
+            try:
+                async with postgres_cursor(self._pg_pool) as cursor:
+                    await write_events(cursor, messages)
+                await self._consumer.commit({tp: messages[-1].offset + 1})
+            except Exception:
+                # batch is read again after backoff
+                logger.exception("failed kafka to postgres transfer for partition: %s", tp.partition)
+                if tp in self._workers:
+                    self._consumer.seek(tp, messages[0].offset)
+                await asyncio.sleep(config.TRANSFER_RETRY_BACKOFF)
+            finally:
+                queue.task_done()
+            if tp in self._workers:
+                self._consumer.resume(tp)
+
+
+async def maintain_events(pg_pool):
+    while True:
+        await asyncio.sleep(config.EVENTS_MAINTENANCE_INTERVAL)
+        try:
+            await maintain_events_partitions(pg_pool)
+        except Exception:
+            logger.exception("failed events partitions maintenance")
+
+
+async def main():
+    metrics.start_metrics_server(config.METRICS_PORT)
+    pg_pool = await postgres_pool_factory(config.POSTGRES_CONFIG)
+    await ensure_db_configured(pg_pool)
+    transfer = asyncio.ensure_future(PartitionsTransfer(pg_pool).run())
+    maintenance = asyncio.ensure_future(maintain_events(pg_pool))
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, transfer.cancel)
+    try:
+        await transfer
+    except asyncio.CancelledError:
+        logger.info("kafka to postgres transfer stopped")
+    finally:
+        maintenance.cancel()
+        transfer_summary.flush()
+        pg_pool.close()
+        await pg_pool.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
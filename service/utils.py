@@ -1,20 +1,51 @@
+import asyncio
+import contextlib
 import re
 import time
+import zlib
+from collections import OrderedDict, deque
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Tuple, Optional
+from functools import lru_cache, wraps
+from typing import Dict, List, Tuple, Optional, Pattern
 
 import httpx
 
-from service import config
+from service import config, metrics
 from service.entities import Event
+from service.http_client import mark, timed_request, timing_phases
 
+BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+# global inline flags, e.g. `(?i)`, apply to whole combined pattern, scoped `(?i:...)` ones don't
+INLINE_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+# assertions which depend on what follows match, at end of streamed window they see window end
+# instead of the next body bytes
+END_ASSERTION = re.compile(r"\$|\\[ZbB]|\(\?[=!]")
+HEAD_REJECTED_STATUSES = (405, 501)
 
+
+def timed(fetch_function):
+    # request phases are measured with monotonic clock in addition to wall clock duration, they are
+    # filled for failed requests too, so slow dns or connect can be distinguished from timeout
+    @wraps(fetch_function)
+    async def wrapper(*args, **kwargs):
+        with timed_request() as marks:
+            result = await fetch_function(*args, **kwargs)
+            mark("end")
+        event = result[0] if isinstance(result, tuple) else result
+        event.timings = timing_phases(marks)
+        return result
+
+    return wrapper
+
+
+@timed
 async def fetch(client: httpx.AsyncClient, url: str) -> Tuple[Event, Optional[bytes]]:
     # assume that availability check doesn't require other to GET method and extra headers
     start = time.time()
     try:
-        # assume we don't need to handle case when response body too big
-        # by the way it can be handled by timeout indirectly
+        # assume we don't need to handle case when response body too big, see fetch_and_check
+        # for streaming alternative, by the way it can be handled by timeout indirectly
         # in bad case no response size limit can be issue of huge memory and networking usage
         # attacks for user content
         response = await client.get(url, timeout=config.FETCH_TIMEOUT)
@@ -36,12 +67,333 @@ async def fetch(client: httpx.AsyncClient, url: str) -> Tuple[Event, Optional[by
         )
 
 
-def regexp_check(regexp: str, content: bytes) -> Optional[bool]:
-    # assume that there are no valid user inputted regexp that do heavy computations
-    if content is None or regexp is None:
+@timed
+async def fetch_and_check(
+    client: httpx.AsyncClient, url: str, regexp: Optional[str], patterns: Optional[List[str]] = None
+) -> Event:
+    # body is never kept in memory, only current chunk with tail of previous chunks, duration
+    # measured till all patterns are found or limit, so it can be less than full body download time
+    start = time.time()
+    wanted = ([regexp] if regexp is not None else []) + (patterns or [])
+    try:
+        async with client.stream("GET", url, timeout=config.FETCH_TIMEOUT) as response:
+            # pattern-less check doesn't read body, connection just closed instead
+            found = await stream_patterns_check(wanted, response) if wanted else {}
+            return Event(
+                id=None,
+                created_at=datetime.fromtimestamp(start),
+                url=url,
+                duration=time.time() - start,
+                status_code=response.status_code,
+                regexp_found=found[regexp] if regexp is not None else None,
+                patterns_found={pattern: found[pattern] for pattern in patterns} if patterns else None,
+            )
+
+    except httpx.HTTPError as err:
+        return Event(id=None, created_at=datetime.fromtimestamp(start), url=url, duration=time.time() - start)
+
+
+@timed
+async def fetch_head(client: httpx.AsyncClient, url: str) -> Event:
+    # pattern-less check needs status code only, body of GET fallback isn't read
+    start = time.time()
+    try:
+        response = await client.head(url, timeout=config.FETCH_TIMEOUT)
+        if response.status_code in HEAD_REJECTED_STATUSES:
+            async with client.stream("GET", url, timeout=config.FETCH_TIMEOUT) as response:
+                pass
+        return Event(
+            id=None,
+            created_at=datetime.fromtimestamp(start),
+            url=url,
+            duration=time.time() - start,
+            status_code=response.status_code,
+        )
+
+    except httpx.HTTPError as err:
+        return Event(id=None, created_at=datetime.fromtimestamp(start), url=url, duration=time.time() - start)
+
+
+@dataclass
+class CachedCheck:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    regexp_found: Optional[bool]
+    patterns_found: Optional[Dict[str, bool]]
+
+
+class ChecksCache:
+    """Last check verdicts with response validators by url and patterns, least recently used are evicted."""
+
+    def __init__(self, size: int = config.FETCH_CONDITIONAL_CACHE_SIZE):
+        self._size = size
+        self._checks = OrderedDict()
+
+    def get(self, key) -> Optional[CachedCheck]:
+        cached = self._checks.get(key)
+        if cached is not None:
+            self._checks.move_to_end(key)
+        return cached
+
+    def put(self, key, cached: CachedCheck):
+        self._checks[key] = cached
+        self._checks.move_to_end(key)
+        if len(self._checks) > self._size:
+            self._checks.popitem(last=False)
+
+    def pop(self, key):
+        self._checks.pop(key, None)
+
+
+@timed
+async def fetch_conditional(
+    client: httpx.AsyncClient,
+    cache: ChecksCache,
+    url: str,
+    regexp: Optional[str],
+    patterns: Optional[List[str]] = None,
+) -> Event:
+    # verdict is cached for url with the same patterns only, so changed site patterns are checked
+    # against full body
+    start = time.time()
+    key = (url, regexp, tuple(patterns or ()))
+    cached = cache.get(key)
+    headers = {}
+    if cached is not None and cached.etag is not None:
+        headers["If-None-Match"] = cached.etag
+    if cached is not None and cached.last_modified is not None:
+        headers["If-Modified-Since"] = cached.last_modified
+    wanted = ([regexp] if regexp is not None else []) + (patterns or [])
+    try:
+        async with client.stream("GET", url, headers=headers, timeout=config.FETCH_TIMEOUT) as response:
+            if response.status_code == 304 and cached is not None:
+                regexp_found, patterns_found = cached.regexp_found, cached.patterns_found
+            else:
+                if config.FETCH_STREAMING:
+                    found = await stream_patterns_check(wanted, response)
+                    regexp_found = found[regexp] if regexp is not None else None
+                    patterns_found = {pattern: found[pattern] for pattern in patterns} if patterns else None
+                else:
+                    content = await response.aread()
+                    regexp_found = regexp_check(regexp, content)
+                    patterns_found = patterns_check(patterns, content)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                if response.status_code == 200 and (etag is not None or last_modified is not None):
+                    cache.put(key, CachedCheck(etag, last_modified, regexp_found, patterns_found))
+                else:
+                    cache.pop(key)
+            return Event(
+                id=None,
+                created_at=datetime.fromtimestamp(start),
+                url=url,
+                duration=time.time() - start,
+                status_code=response.status_code,
+                regexp_found=regexp_found,
+                patterns_found=patterns_found,
+            )
+
+    except httpx.HTTPError as err:
+        return Event(id=None, created_at=datetime.fromtimestamp(start), url=url, duration=time.time() - start)
+
+
+async def stream_patterns_check(patterns: List[str], response: httpx.Response) -> Dict[str, bool]:
+    # every window but the first one is searched from the second byte, so `^` and `\A` don't match
+    # at window start and lookbehinds see the previous byte, patterns with end assertions (e.g. `$`)
+    # are checked against whole body after its end, so verdict is the same as for full fetch
+    found = dict.fromkeys(patterns, False)
+    valid = [pattern for pattern in found if compile_pattern(pattern) is not None]
+    end_dependent = [pattern for pattern in valid if END_ASSERTION.search(pattern)]
+    remaining = [pattern for pattern in valid if pattern not in end_dependent]
+    body = [] if end_dependent else None
+    size = 0
+    tail = b""
+    async for chunk in response.aiter_bytes():
+        if not remaining and body is None:
+            break
+        chunk = chunk[: config.FETCH_MAX_BODY_SIZE - size]
+        size += len(chunk)
+        if body is not None:
+            body.append(chunk)
+        window = tail + chunk
+        if remaining:
+            checked = patterns_check(remaining, window, 1 if tail else 0)
+            found.update((pattern, True) for pattern, value in checked.items() if value)
+            remaining = [pattern for pattern in remaining if not found[pattern]]
+        if size >= config.FETCH_MAX_BODY_SIZE:
+            break
+        tail = window[-(config.FETCH_REGEXP_OVERLAP + 1) :]
+    if end_dependent:
+        found.update(patterns_check(end_dependent, b"".join(body)))
+    return found
+
+
+@lru_cache(maxsize=config.REGEXP_CACHE_SIZE)
+def compile_pattern(regexp: str) -> Optional[Pattern[bytes]]:
+    # invalid pattern cached as None, so it isn't compiled again on every check
+    try:
+        return re.compile(regexp.encode("utf8"))
+    except re.error:
         return None
 
+
+@lru_cache(maxsize=config.REGEXP_CACHE_SIZE)
+def compile_patterns(patterns: Tuple[str, ...]) -> Optional[Pattern[bytes]]:
+    # valid patterns combined to alternation with named group per pattern, group name is index of
+    # pattern, patterns with backreferences are excluded as groups are renumbered in alternation and
+    # patterns with global inline flags are excluded as the flags would change other patterns
+    alternatives = []
+    for i, pattern in enumerate(patterns):
+        if compile_pattern(pattern) is not None and not checked_separately(pattern):
+            alternatives.append(f"(?P<_{i}>{pattern})")
+    if not alternatives:
+        return None
     try:
-        return re.search(regexp.encode("utf8"), content) is not None
+        return re.compile("|".join(alternatives).encode("utf8"))
     except re.error:
+        # e.g. the same group names in different patterns
+        return None
+
+
+def patterns_check(patterns: List[str], content: bytes, pos: int = 0) -> Optional[Dict[str, bool]]:
+    if content is None or not patterns:
+        return None
+
+    found = dict.fromkeys(patterns, False)
+    combined = compile_patterns(tuple(found))
+    matched = False
+    if combined is not None:
+        ordered = list(found)
+        for match in combined.finditer(content, pos):
+            matched = True
+            found[ordered[int(match.lastgroup[1:])]] = True
+            if all(found.values()):
+                return found
+    # match of one pattern can hide overlapping match of other one, so not found patterns are
+    # checked separately, no match at all means that none of combined patterns can be found
+    for pattern, value in found.items():
+        if not value and (matched or combined is None or checked_separately(pattern)):
+            found[pattern] = regexp_check(pattern, content, pos)
+    return found
+
+
+def checked_separately(pattern: str) -> bool:
+    return BACKREFERENCE.search(pattern) is not None or INLINE_FLAGS.search(pattern) is not None
+
+
+def regexp_check(regexp: str, content: bytes, pos: int = 0) -> Optional[bool]:
+    # assume that there are no valid user inputted regexp that do heavy computations
+    if content is None or regexp is None:
+        return None
+
+    pattern = compile_pattern(regexp)
+    if pattern is None:
         return False
+    # search from pos sees content before it for lookbehinds, `^` doesn't match at pos
+    return pattern.search(content, pos) is not None
+
+
+def schedule_jitter(url: str, window: float) -> float:
+    # deterministic offset inside of window, so every site is checked at the same second of
+    # scheduler tick and checks are spread evenly instead of peak at tick start
+    if not window:
+        return 0
+    return zlib.crc32(url.encode("utf8")) / 2 ** 32 * window
+
+
+class AdaptiveLimiter:
+    """Concurrency limit of checks adapted by additive increase and multiplicative decrease.
+
+    Limit is doubled every round of `limit` checks on start and then is increased by one per round
+    while there is no overload. Event loop lag above `lag_threshold` or short term checks duration
+    average above `latency_inflation` times long term one means overload, then limit is multiplied by
+    `backoff`, not more often than once per round. Limit is kept between `min_limit` and `max_limit`.
+    """
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        lag_threshold: float = 0.1,
+        latency_inflation: float = 2,
+        backoff: float = 0.75,
+    ):
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._lag_threshold = lag_threshold
+        self._latency_inflation = latency_inflation
+        self._backoff = backoff
+        self._in_flight = 0
+        self._waiters = deque()
+        self._slow_start = True
+        self._round = 0  # checks finished since last limit change
+        self._short_latency = None
+        self._long_latency = None
+        self.lag = 0
+        self.limit = min_limit
+        self._set_limit(min_limit)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._in_flight >= self.limit or self._waiters:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    self._in_flight -= 1
+                    self._wake_up()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        else:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._wake_up()
+
+    def observe(self, duration: float):
+        # averages are taken across sites, so they are stable for usual mix of fast and slow sites
+        if self._long_latency is None:
+            self._short_latency = self._long_latency = duration
+        self._short_latency += (duration - self._short_latency) * 0.1
+        self._long_latency += (duration - self._long_latency) * 0.01
+        self._round += 1
+        overloaded = self.lag > self._lag_threshold or (
+            self._short_latency > self._long_latency * self._latency_inflation
+        )
+        if overloaded:
+            if self._round >= self.limit:
+                self._slow_start = False
+                self._set_limit(int(self.limit * self._backoff))
+        elif self._slow_start:
+            self._set_limit(self.limit + 1)
+        elif self._round >= self.limit:
+            self._set_limit(self.limit + 1)
+
+    async def monitor_lag(self, interval: float = 0.5):
+        # event loop lag is delay of timer callback, it grows when loop is busy with checks
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.lag = loop.time() - start - interval
+            metrics.EVENT_LOOP_LAG.set(self.lag)
+
+    def _set_limit(self, limit):
+        limit = min(max(limit, self._min_limit), self._max_limit)
+        if limit != self.limit:
+            self._round = 0
+        self.limit = limit
+        metrics.CHECKS_CONCURRENCY_LIMIT.set(limit)
+        self._wake_up()
+
+    def _wake_up(self):
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
@@ -20,7 +20,7 @@ setup(
         "Programming Language :: Python",
         "Programming Language :: Python :: 3.8",
     ],
-    packages=find_packages(exclude=["tests*"]),
+    packages=find_packages(exclude=["tests*", "benchmarks*"]),
     python_requires="==3.8",
     install_requires=[r for l in open("requirements.txt").readlines() if (r := re.sub(r"#.*", "", l).strip())],
 )
@@ -12,9 +12,11 @@ from service.kafka import kafka_producer_factory, kafka_consumer_factory
 from service.db import (
     SiteCheckPgManager,
     EventPgManager,
+    SiteStatusPgManager,
     postgres_pool_factory,
     postgres_cursor,
 )
+from service.utils import AdaptiveLimiter, ChecksCache
 
 POSTGRES_MAINTENANCE_DB = "postgres"
 
@@ -72,6 +74,14 @@ async def event_pg_manager(pg_cursor):
     yield manager
 
 
+@pytest.fixture
+async def site_status_pg_manager(pg_cursor):
+    manager = SiteStatusPgManager(pg_cursor)
+    await manager.create_pg_schema()
+    await manager.delete_all()
+    yield manager
+
+
 @pytest.fixture(scope="session")
 def redis_db():
     return config.REDIS_DB + 1
@@ -110,6 +120,13 @@ async def kafka_consumer(kafka_topic):
     await consumer.stop()
 
 
+@pytest.fixture(autouse=True)
+def schedule_jitter_window():
+    # burst workers shouldn't wait deferred checks
+    with mock.patch.object(config, "SCHEDULE_JITTER_WINDOW", 0):
+        yield 0
+
+
 @pytest.fixture
 async def http_client():
     client = httpx.AsyncClient()
@@ -121,6 +138,8 @@ async def http_client():
 def ctx(http_client, pg_pool, redis_pool, kafka_producer, kafka_consumer):
     return {
         "http_client": http_client,
+        "checks_cache": ChecksCache(),
+        "concurrency_limiter": AdaptiveLimiter(10, 10),
         "pg_pool": pg_pool,
         "redis_pool": redis_pool,
         "kafka_producer": kafka_producer,
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from service.db import ensure_db_configured
+from service.embedded import EventsQueue, JobsQueue, PgStore, run_pipeline
+from service.utils import AdaptiveLimiter, ChecksCache
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline__pg_store(pg_pool, site_check_pg_manager, site_status_pg_manager, http_client, httpx_mock):
+    await ensure_db_configured(pg_pool)
+    await site_check_pg_manager.create("http://test1.com", "ok")
+    await site_check_pg_manager.create("http://test2.com", None)
+    httpx_mock.add_response(status_code=200, data=b"ok")
+    ctx = {
+        "http_client": http_client,
+        "checks_cache": ChecksCache(),
+        "concurrency_limiter": AdaptiveLimiter(10, 10),
+        "redis_pool": JobsQueue(10),
+        "kafka_producer": EventsQueue(10),
+    }
+    pipeline = asyncio.ensure_future(run_pipeline(ctx, PgStore(pg_pool), checkers=2))
+    try:
+        for _ in range(100):
+            statuses = [s async for s in site_status_pg_manager.get_all()]
+            if len(statuses) == 2:
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        pipeline.cancel()
+        await asyncio.gather(pipeline, return_exceptions=True)
+
+    assert sorted(s.url for s in statuses) == ["http://test1.com", "http://test2.com"]
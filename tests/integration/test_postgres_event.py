@@ -1,7 +1,10 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pytest
 
+from service.db import EventPgManager
+from service.entities import Event
+
 
 @pytest.mark.asyncio
 async def test_operations__success(pg_cursor, event_pg_manager):
@@ -35,3 +38,147 @@ async def test_operations__success(pg_cursor, event_pg_manager):
 
     await event_pg_manager.delete_all()
     assert [e async for e in event_pg_manager.get_all()] == []
+
+
+@pytest.mark.asyncio
+async def test_create_many__success(pg_cursor, event_pg_manager):
+    assert await event_pg_manager.create_many([]) == []
+
+    events = await event_pg_manager.create_many(
+        [
+            Event(None, datetime(2020, 12, 20), "http://test1.com", 1.1, 200, True),
+            Event(None, datetime(2020, 12, 21), "http://test2.com", 2.2, None, None),
+        ]
+    )
+    assert all(e.id > 0 for e in events)
+    assert [e.url for e in events] == ["http://test1.com", "http://test2.com"]
+    for event in events:
+        assert await event_pg_manager.get_by_id(event.id) == event
+
+
+@pytest.mark.asyncio
+async def test_partitions__maintenance(pg_cursor, event_pg_manager):
+    now = datetime(2020, 12, 20, 12)
+    await event_pg_manager.ensure_partitions(now - timedelta(days=40))
+    await event_pg_manager.ensure_partitions(now)
+    partitions = dict(await event_pg_manager.get_partitions())
+    assert partitions["events_default"] is None
+    assert partitions["events_p20201110"] == datetime(2020, 11, 11)
+    assert partitions["events_p20201223"] == datetime(2020, 12, 24)
+
+    expired = await event_pg_manager.create(datetime(2020, 11, 10), "http://test.com", 1.1, 200, None)
+    actual = await event_pg_manager.create(datetime(2020, 12, 20), "http://test.com", 1.1, 200, None)
+    dropped = await event_pg_manager.drop_expired_partitions(now)
+    assert dropped == ["events_p20201110", "events_p20201111", "events_p20201112", "events_p20201113"]
+    assert await event_pg_manager.get_by_id(expired.id) is None
+    assert await event_pg_manager.get_by_id(actual.id) == actual
+
+
+@pytest.mark.asyncio
+async def test_partitions__default_rows_moved(pg_cursor, event_pg_manager):
+    now = datetime(2020, 12, 20, 12)
+    # events of days without partitions are kept in default partition
+    late = await event_pg_manager.create(datetime(2020, 12, 26, 10), "http://test.com", 1.1, 200, None)
+    other = await event_pg_manager.create(datetime(2020, 12, 28, 10), "http://test.com", 1.1, 200, None)
+    await event_pg_manager.ensure_partitions(now + timedelta(days=6))
+    partitions = dict(await event_pg_manager.get_partitions())
+    assert partitions["events_p20201226"] == datetime(2020, 12, 27)
+    await pg_cursor.execute("SELECT id FROM events_p20201226")
+    assert await pg_cursor.fetchall() == [(late.id,)]
+    await pg_cursor.execute("SELECT id FROM events_default")
+    assert (other.id,) not in await pg_cursor.fetchall()
+    assert await event_pg_manager.get_by_id(late.id) == late
+    await event_pg_manager.delete_all()
+
+
+class MigrationEventPgManager(EventPgManager):
+
+    table = "events_migration"
+
+
+@pytest.mark.asyncio
+async def test_partitions__migration(pg_cursor):
+    await pg_cursor.execute("DROP TABLE IF EXISTS events_migration, events_migration_legacy CASCADE")
+    await pg_cursor.execute(
+        """
+        CREATE TABLE events_migration (
+            id SERIAL PRIMARY KEY,
+            created_at TIMESTAMP,
+            url VARCHAR(255),
+            duration FLOAT,
+            status_code INT NULL,
+            regexp_found BOOL NULL
+        )"""
+    )
+    await pg_cursor.execute(
+        """
+        INSERT INTO events_migration (created_at, url, duration, status_code, regexp_found)
+        VALUES ('2020-12-20', 'http://test.com', 1.1, 200, NULL)
+        RETURNING (id)"""
+    )
+    (legacy_id,) = await pg_cursor.fetchone()
+    manager = MigrationEventPgManager(pg_cursor)
+
+    await manager.create_pg_schema()
+    await manager.create_pg_schema()
+    assert "events_migration_legacy" in dict(await manager.get_partitions())
+    event = await manager.create(datetime.now(), "http://test.com", 1.1, 200, None)
+    assert event.id > legacy_id
+    assert [e.id async for e in manager.get_all()] == [legacy_id, event.id]
+    await pg_cursor.execute("DROP TABLE events_migration")
+
+
+@pytest.mark.asyncio
+async def test_partitions__migration_today_rows(pg_cursor):
+    await pg_cursor.execute("DROP TABLE IF EXISTS events_migration, events_migration_legacy CASCADE")
+    await pg_cursor.execute(
+        """
+        CREATE TABLE events_migration (
+            id SERIAL PRIMARY KEY,
+            created_at TIMESTAMP,
+            url VARCHAR(255),
+            duration FLOAT,
+            status_code INT NULL,
+            regexp_found BOOL NULL
+        )"""
+    )
+    await pg_cursor.execute(
+        """
+        INSERT INTO events_migration (created_at, url, duration, status_code, regexp_found)
+        VALUES (%s, 'http://test.com', 1.1, 200, NULL)
+        RETURNING (id)""",
+        (datetime.now(),),
+    )
+    (legacy_id,) = await pg_cursor.fetchone()
+    manager = MigrationEventPgManager(pg_cursor)
+
+    await manager.create_pg_schema()
+    partitions = dict(await manager.get_partitions())
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    assert partitions["events_migration_legacy"] == datetime.combine(tomorrow, datetime.min.time())
+    assert f"events_migration_p{datetime.now():%Y%m%d}" not in partitions
+    assert f"events_migration_p{tomorrow:%Y%m%d}" in partitions
+    event = await manager.create(datetime.now(), "http://test.com", 1.1, 200, None)
+    assert [e.id async for e in manager.get_all()] == [legacy_id, event.id]
+    await pg_cursor.execute("DROP TABLE events_migration")
+
+
+@pytest.mark.asyncio
+async def test_patterns_found__success(pg_cursor, event_pg_manager):
+    event = await event_pg_manager.create(datetime(2020, 12, 20), "http://test.com", 1.1, 200, None, {"a": True})
+    [many] = await event_pg_manager.create_many(
+        [Event(None, datetime(2020, 12, 20), "http://test.com", 1.1, 200, None, {"b": False})]
+    )
+    assert (await event_pg_manager.get_by_id(event.id)).patterns_found == {"a": True}
+    assert (await event_pg_manager.get_by_id(many.id)).patterns_found == {"b": False}
+    await event_pg_manager.delete_all()
+
+
+@pytest.mark.asyncio
+async def test_timings__success(pg_cursor, event_pg_manager):
+    timings = {"queue": 0.001, "dns": 0.01, "ttfb": 0.2}
+    [event] = await event_pg_manager.create_many(
+        [Event(None, datetime(2020, 12, 20), "http://test.com", 1.1, 200, None, None, timings)]
+    )
+    assert (await event_pg_manager.get_by_id(event.id)).timings == timings
+    await event_pg_manager.delete_all()
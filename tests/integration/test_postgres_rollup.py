@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+
+from service.db import MinuteRollupPgManager
+from service.entities import Event
+from service.rollups import aggregate_rollups, sketch_quantile
+
+
+@pytest.fixture
+async def minute_rollup_pg_manager(pg_cursor):
+    manager = MinuteRollupPgManager(pg_cursor)
+    await manager.create_pg_schema()
+    await manager.delete_all()
+    yield manager
+
+
+@pytest.mark.asyncio
+async def test_upsert_many__merge(pg_cursor, minute_rollup_pg_manager):
+    await minute_rollup_pg_manager.upsert_many([])
+    first = [
+        Event(None, datetime(2020, 12, 20, 10, 1, 1), "http://test.com", 0.1, 200, True),
+        Event(None, datetime(2020, 12, 20, 10, 2, 1), "http://test.com", 0.2, 200, True),
+    ]
+    second = [
+        Event(None, datetime(2020, 12, 20, 10, 1, 2), "http://test.com", 0.3, None, False),
+        Event(None, datetime(2020, 12, 20, 10, 1, 3), "http://other.com", 0.3, 200, None),
+    ]
+    await minute_rollup_pg_manager.upsert_many(aggregate_rollups(first, minute_rollup_pg_manager.resolution))
+    await minute_rollup_pg_manager.upsert_many(aggregate_rollups(second, minute_rollup_pg_manager.resolution))
+
+    rollups = [
+        r
+        async for r in minute_rollup_pg_manager.get_by_url(
+            "http://test.com", datetime(2020, 12, 20, 10), datetime(2020, 12, 20, 11)
+        )
+    ]
+    assert [r.bucket for r in rollups] == [datetime(2020, 12, 20, 10, 1), datetime(2020, 12, 20, 10, 2)]
+    rollup = rollups[0]
+    assert rollup.count == 2
+    assert rollup.failures == 1
+    assert rollup.regexp_misses == 1
+    assert rollup.duration_min == 0.1
+    assert rollup.duration_max == 0.3
+    assert rollup.duration_sum == pytest.approx(0.4)
+    assert rollup.latency_sketch == aggregate_rollups(first[:1] + second[:1], "minute")[0].latency_sketch
+    assert sketch_quantile(rollup.latency_sketch, 1) == pytest.approx(0.3, rel=0.05)
@@ -1,5 +1,10 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
 import pytest
 
+from service import config
+
 
 @pytest.mark.asyncio
 async def test_operations__success(pg_cursor, site_check_pg_manager):
@@ -8,6 +13,7 @@ async def test_operations__success(pg_cursor, site_check_pg_manager):
     assert site_check.id > 0
     assert site_check.url == "http://test.com"
     assert site_check.regexp == "test"
+    assert site_check.interval == 60
 
     site_check = await site_check_pg_manager.get_by_id(0)
     assert site_check is None
@@ -24,3 +30,100 @@ async def test_operations__success(pg_cursor, site_check_pg_manager):
 
     await site_check_pg_manager.delete_all()
     assert [e async for e in site_check_pg_manager.get_all()] == []
+
+
+@pytest.mark.asyncio
+async def test_claim_due__success(pg_cursor, site_check_pg_manager):
+    now = datetime(2020, 12, 20)
+    await site_check_pg_manager.create("http://minute.com", None, interval=60, next_check_at=now)
+    await site_check_pg_manager.create("http://hour.com", None, interval=3600, next_check_at=now)
+    await site_check_pg_manager.create("http://later.com", None, interval=60, next_check_at=now + timedelta(hours=1))
+
+    claimed = [e async for e in site_check_pg_manager.claim_due(now)]
+    assert sorted((e.url, e.interval) for e in claimed) == [("http://hour.com", 3600), ("http://minute.com", 60)]
+    assert [e async for e in site_check_pg_manager.claim_due(now)] == []
+
+    claimed = [e async for e in site_check_pg_manager.claim_due(now + timedelta(minutes=1))]
+    assert [e.url for e in claimed] == ["http://minute.com"]
+
+    # scheduler was behind for a few intervals, site checked only once
+    claimed = [e async for e in site_check_pg_manager.claim_due(now + timedelta(minutes=10))]
+    assert [e.url for e in claimed] == ["http://minute.com"]
+    assert [e async for e in site_check_pg_manager.claim_due(now + timedelta(minutes=10))] == []
+    claimed = [e async for e in site_check_pg_manager.claim_due(now + timedelta(minutes=11))]
+    assert [e.url for e in claimed] == ["http://minute.com"]
+
+
+@pytest.mark.asyncio
+async def test_claim_due__spread_over_interval(pg_cursor, site_check_pg_manager):
+    now = datetime(2020, 12, 20)
+    for i in range(100):
+        await site_check_pg_manager.create(f"http://test{i}.com", None, interval=3600, next_check_at=now)
+    assert len([e async for e in site_check_pg_manager.claim_due(now)]) == 100
+
+    # sites added together are due at own minutes of the hour, every site once per interval
+    claims = {}
+    for minute in range(1, 121):
+        async for e in site_check_pg_manager.claim_due(now + timedelta(minutes=minute)):
+            claims.setdefault(e.url, []).append(minute)
+    assert len(claims) == 100
+    assert all(second - first == 60 for first, second in claims.values())
+    assert len({first for first, _ in claims.values()}) > 40
+    await site_check_pg_manager.delete_all()
+
+
+@pytest.mark.asyncio
+async def test_create__invalid_regexp(pg_cursor, site_check_pg_manager):
+    with pytest.raises(ValueError):
+        await site_check_pg_manager.create("http://test.com", "(test")
+    assert [e async for e in site_check_pg_manager.get_all()] == []
+
+
+@pytest.mark.asyncio
+async def test_patterns__success(pg_cursor, site_check_pg_manager):
+    site_check = await site_check_pg_manager.create("http://test.com", None, patterns=["a+", "b"])
+    assert (await site_check_pg_manager.get_by_id(site_check.id)).patterns == ["a+", "b"]
+    with pytest.raises(ValueError):
+        await site_check_pg_manager.create("http://test.com", None, patterns=["a", "(b"])
+    await site_check_pg_manager.delete_all()
+
+
+@pytest.mark.asyncio
+async def test_get_all__chunks(pg_cursor, site_check_pg_manager):
+    for i in range(5):
+        await site_check_pg_manager.create(f"http://test{i}.com", None)
+    with mock.patch.object(config, "PG_FETCH_CHUNK_SIZE", 2):
+        assert [e.url async for e in site_check_pg_manager.get_all()] == [f"http://test{i}.com" for i in range(5)]
+    await site_check_pg_manager.delete_all()
+
+
+@pytest.mark.asyncio
+async def test_claim_due__chunks_and_shards(pg_cursor, site_check_pg_manager):
+    now = datetime(2020, 12, 20)
+    sites = [
+        await site_check_pg_manager.create(f"http://test{i}.com", None, next_check_at=now - timedelta(seconds=i % 3))
+        for i in range(7)
+    ]
+    with mock.patch.object(config, "PG_FETCH_CHUNK_SIZE", 2):
+        shard_0 = [e.id async for e in site_check_pg_manager.claim_due(now, shard=0, shards=2)]
+        shard_1 = [e.id async for e in site_check_pg_manager.claim_due(now, shard=1, shards=2)]
+    assert all(site_id % 2 == 0 for site_id in shard_0)
+    assert all(site_id % 2 == 1 for site_id in shard_1)
+    assert sorted(shard_0 + shard_1) == [site.id for site in sites]
+    assert [e async for e in site_check_pg_manager.claim_due(now)] == []
+    await site_check_pg_manager.delete_all()
+
+
+@pytest.mark.asyncio
+async def test_claim_due__unclaim_not_read(pg_cursor, site_check_pg_manager):
+    now = datetime(2020, 12, 20)
+    for i in range(5):
+        await site_check_pg_manager.create(f"http://test{i}.com", None, next_check_at=now - timedelta(seconds=i))
+    with mock.patch.object(config, "PG_FETCH_CHUNK_SIZE", 3):
+        claimed = site_check_pg_manager.claim_due(now)
+        read = [await claimed.__anext__(), await claimed.__anext__()]
+        await claimed.aclose()
+        # the rest of claimed chunk is due again, not claimed chunks weren't touched
+        not_read = [e.url async for e in site_check_pg_manager.claim_due(now)]
+    assert sorted([e.url for e in read] + not_read) == [f"http://test{i}.com" for i in range(5)]
+    await site_check_pg_manager.delete_all()
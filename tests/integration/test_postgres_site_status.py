@@ -0,0 +1,34 @@
+from datetime import datetime
+
+import pytest
+
+from service.entities import Event
+
+
+@pytest.mark.asyncio
+async def test_upsert_many__latest(pg_cursor, site_status_pg_manager):
+    await site_status_pg_manager.upsert_many([])
+    await site_status_pg_manager.upsert_many(
+        [
+            Event(1, datetime(2020, 12, 20, 10, 1), "http://test.com", 0.1, 200, True),
+            Event(2, datetime(2020, 12, 20, 10, 3), "http://test.com", 0.2, 500, False),
+            Event(3, datetime(2020, 12, 20, 10, 2), "http://test.com", 0.3, 200, True),
+            Event(4, datetime(2020, 12, 20, 10, 1), "http://other.com", 0.4, None, None),
+        ]
+    )
+    status = await site_status_pg_manager.get_by_url("http://test.com")
+    assert status == Event(2, datetime(2020, 12, 20, 10, 3), "http://test.com", 0.2, 500, False)
+
+    # older event from delayed batch doesn't replace status
+    await site_status_pg_manager.upsert_many(
+        [
+            Event(5, datetime(2020, 12, 20, 10, 0), "http://test.com", 0.5, 200, True),
+            Event(6, datetime(2020, 12, 20, 10, 5), "http://other.com", 0.6, 200, None),
+        ]
+    )
+    assert (await site_status_pg_manager.get_by_url("http://test.com")).id == 2
+    assert await site_status_pg_manager.get_by_url("http://unknown.com") is None
+    assert sorted([(e.url, e.id) async for e in site_status_pg_manager.get_all()]) == [
+        ("http://other.com", 6),
+        ("http://test.com", 2),
+    ]
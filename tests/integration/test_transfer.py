@@ -0,0 +1,28 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from service.entities import Event
+from service.kafka import put_results_to_kafka
+from service.transfer import PartitionsTransfer
+
+
+@pytest.mark.asyncio
+async def test_partitions_transfer__success(pg_pool, event_pg_manager, kafka_producer, kafka_topic):
+    for i in range(3):
+        event = Event(id=None, created_at=datetime(2020, 12, 20), url=f"http://test{i}.com", duration=1.1)
+        await put_results_to_kafka(kafka_producer, event)
+
+    transfer = asyncio.ensure_future(PartitionsTransfer(pg_pool).run())
+    try:
+        for _ in range(100):
+            events = [e async for e in event_pg_manager.get_all()]
+            if len(events) == 3:
+                break
+            await asyncio.sleep(0.1)
+    finally:
+        transfer.cancel()
+        await asyncio.gather(transfer, return_exceptions=True)
+
+    assert sorted(e.url for e in events) == ["http://test0.com", "http://test1.com", "http://test2.com"]
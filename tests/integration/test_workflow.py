@@ -1,8 +1,12 @@
+from unittest import mock
+
 import arq
 import pytest
 
+from service import config
 from service.jobs import (
     availability_check,
+    availability_check_batch,
     schedule_availability_checks,
     kafka_to_pg_transfer,
     CheckSchedulerWorkerSettings,
@@ -46,3 +50,38 @@ async def test_schedule__success(pg_cursor, site_check_pg_manager, event_pg_mana
     assert len(events) == 1
     assert events[0].url == "http://test.com"
     assert events[0].status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_schedule__batch_success(pg_cursor, site_check_pg_manager, event_pg_manager, arq_worker, httpx_mock):
+    await site_check_pg_manager.create("http://test1.com", "test")
+    await site_check_pg_manager.create("http://test2.com", "test")
+    await site_check_pg_manager.create("http://test3.com", None)
+
+    with mock.patch.object(config, "SCHEDULE_BATCH_SIZE", 2):
+        schedule_worker = arq_worker(
+            cron_jobs=[arq.cron(schedule_availability_checks, hour=1, run_at_startup=True)],
+            queue_name=CheckSchedulerWorkerSettings.queue_name,
+        )
+        await schedule_worker.main()
+    assert schedule_worker.jobs_complete == 1
+    assert schedule_worker.jobs_failed == 0
+
+    httpx_mock.add_response(status_code=200, data=b"test")
+    check_worker = arq_worker(
+        functions=[availability_check, availability_check_batch],
+        queue_name=AvailabilityCheckerWorkerSettings.queue_name,
+    )
+    await check_worker.main()
+    assert check_worker.jobs_complete == 2
+    assert check_worker.jobs_failed == 0
+
+    transfer_worker = arq_worker(
+        cron_jobs=[arq.cron(kafka_to_pg_transfer, hour=1, run_at_startup=True)],
+        queue_name=KafkaToPostgresTransferWorkerSettings.queue_name,
+    )
+    await transfer_worker.main()
+
+    events = sorted([e async for e in event_pg_manager.get_all()], key=lambda e: e.url)
+    assert [e.url for e in events] == ["http://test1.com", "http://test2.com", "http://test3.com"]
+    assert [e.regexp_found for e in events] == [True, True, None]
@@ -1,9 +1,21 @@
 from datetime import datetime
+from unittest import mock
 
 import httpx
 import pytest
 
-from service.utils import fetch, regexp_check
+from service import config
+from service.utils import (
+    ChecksCache,
+    compile_pattern,
+    compile_patterns,
+    fetch,
+    fetch_and_check,
+    fetch_conditional,
+    fetch_head,
+    patterns_check,
+    regexp_check,
+)
 
 
 @pytest.mark.asyncio
@@ -51,3 +63,197 @@ def test_regexp__no_pattern():
 
 def test_regexp__no_content():
     assert regexp_check("a", None) is None
+
+
+def test_compile_pattern__cached():
+    compile_pattern.cache_clear()
+    assert compile_pattern("a") is compile_pattern("a")
+    assert compile_pattern("(b") is None
+    assert compile_pattern("(b") is None
+    assert compile_pattern.cache_info().hits == 2
+
+
+def test_patterns__found():
+    assert patterns_check(["a+", "c", "d"], b"aaabbbccc") == {"a+": True, "c": True, "d": False}
+
+
+def test_patterns__overlapped_matches():
+    assert patterns_check(["abc", "bc", "b"], b"abc") == {"abc": True, "bc": True, "b": True}
+
+
+def test_patterns__backreference_and_invalid():
+    assert patterns_check([r"(a)\1", "(b", "c"], b"aac") == {r"(a)\1": True, "(b": False, "c": True}
+
+
+@pytest.mark.parametrize(
+    "patterns,content,expected",
+    [
+        (["(?i)abc", "XYZ"], b"xyz", {"(?i)abc": False, "XYZ": False}),
+        (["(?i)abc", "XYZ"], b"ABC XYZ", {"(?i)abc": True, "XYZ": True}),
+        (["(?s)a.b", "c.d"], b"a\nb c\nd", {"(?s)a.b": True, "c.d": False}),
+        (["(?i:abc)", "XYZ"], b"ABC xyz", {"(?i:abc)": True, "XYZ": False}),
+    ],
+)
+def test_patterns__inline_flags(patterns, content, expected):
+    assert patterns_check(patterns, content) == expected
+    assert expected == {pattern: regexp_check(pattern, content) for pattern in patterns}
+
+
+def test_compile_patterns__inline_flags_excluded():
+    assert compile_patterns(("(?i)abc", "XYZ")).pattern == b"(?P<_1>XYZ)"
+    assert compile_patterns(("(?i:abc)", "XYZ")).pattern == b"(?P<_0>(?i:abc))|(?P<_1>XYZ)"
+
+
+def test_patterns__no_patterns_or_content():
+    assert patterns_check(None, b"aaa") is None
+    assert patterns_check(["a"], None) is None
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_check__found(httpx_mock):
+    httpx_mock.add_response(status_code=200, data=stream(b"aaa", b"bbb", b"ccc"))
+    async with httpx.AsyncClient() as client:
+        check_result = await fetch_and_check(client, "http://test.com", "b+")
+    assert check_result.url == "http://test.com"
+    assert check_result.status_code == 200
+    assert check_result.duration > 0
+    assert check_result.regexp_found is True
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_check__found_across_chunks(httpx_mock):
+    httpx_mock.add_response(status_code=200, data=stream(b"aaa", b"bbb", b"ccc"))
+    async with httpx.AsyncClient() as client:
+        check_result = await fetch_and_check(client, "http://test.com", "abbbc")
+    assert check_result.regexp_found is True
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_check__patterns(httpx_mock):
+    httpx_mock.add_response(status_code=200, data=stream(b"aaa", b"bbb", b"ccc"))
+    async with httpx.AsyncClient() as client:
+        check_result = await fetch_and_check(client, "http://test.com", "a", ["abbbc", "d"])
+    assert check_result.regexp_found is True
+    assert check_result.patterns_found == {"abbbc": True, "d": False}
+
+
+@pytest.mark.parametrize(
+    "regexp,chunks",
+    [
+        ("a$", (b"aaa", b"bbb")),
+        ("a$", (b"bbb", b"aaa")),
+        ("a\\Z", (b"aaa", b"bbb")),
+        ("a\\b", (b"aaa", b"bbb")),
+        ("a(?!b)", (b"aaa", b"bbb")),
+        ("^b", (b"aaa", b"bbb")),
+        ("\\Ab", (b"aaa", b"bbb")),
+        ("(?m)^b", (b"aa\n", b"bbb")),
+        ("(?<=a)b", (b"aaa", b"bbb")),
+    ],
+)
+@pytest.mark.asyncio
+async def test_fetch_and_check__anchors_as_full_body(httpx_mock, regexp, chunks):
+    httpx_mock.add_response(status_code=200, data=stream(*chunks))
+    async with httpx.AsyncClient() as client:
+        with mock.patch.object(config, "FETCH_REGEXP_OVERLAP", 2):
+            check_result = await fetch_and_check(client, "http://test.com", regexp, [regexp])
+    assert check_result.regexp_found is regexp_check(regexp, b"".join(chunks))
+    assert check_result.patterns_found == {regexp: regexp_check(regexp, b"".join(chunks))}
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_check__not_found(httpx_mock):
+    httpx_mock.add_response(status_code=200, data=stream(b"aaa", b"bbb", b"ccc"))
+    async with httpx.AsyncClient() as client:
+        check_result = await fetch_and_check(client, "http://test.com", "d")
+    assert check_result.status_code == 200
+    assert check_result.regexp_found is False
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_check__size_limit(httpx_mock):
+    httpx_mock.add_response(status_code=200, data=stream(b"aaa", b"bbb", b"ccc"))
+    async with httpx.AsyncClient() as client:
+        with mock.patch.object(config, "FETCH_MAX_BODY_SIZE", 4):
+            check_result = await fetch_and_check(client, "http://test.com", "bb")
+    assert check_result.status_code == 200
+    assert check_result.regexp_found is False
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_check__no_pattern(httpx_mock):
+    httpx_mock.add_response(status_code=200, data=b"ok")
+    async with httpx.AsyncClient() as client:
+        check_result = await fetch_and_check(client, "http://test.com", None)
+    assert check_result.status_code == 200
+    assert check_result.regexp_found is None
+
+
+@pytest.mark.asyncio
+async def test_fetch_and_check__raise_timeout(httpx_mock):
+    def raise_timeout(request, ext):
+        raise httpx.ReadTimeout("timeout", request=request)
+
+    httpx_mock.add_callback(raise_timeout)
+    async with httpx.AsyncClient() as client:
+        check_result = await fetch_and_check(client, "http://test.com", "a")
+    assert check_result.status_code is None
+    assert check_result.duration > 0
+    assert check_result.regexp_found is None
+
+
+@pytest.mark.asyncio
+async def test_fetch_head__ok(httpx_mock):
+    httpx_mock.add_response(method="HEAD", status_code=200)
+    async with httpx.AsyncClient() as client:
+        check_result = await fetch_head(client, "http://test.com")
+    assert check_result.status_code == 200
+    assert check_result.regexp_found is None
+
+
+@pytest.mark.asyncio
+async def test_fetch_head__get_fallback(httpx_mock):
+    httpx_mock.add_response(method="HEAD", status_code=405)
+    httpx_mock.add_response(method="GET", status_code=200, data=b"ok")
+    async with httpx.AsyncClient() as client:
+        check_result = await fetch_head(client, "http://test.com")
+    assert check_result.status_code == 200
+    assert len(httpx_mock.get_requests()) == 2
+
+
+@pytest.mark.asyncio
+async def test_fetch_conditional__not_modified(httpx_mock):
+    cache = ChecksCache()
+    httpx_mock.add_response(status_code=200, data=b"aaa", headers={"ETag": '"v1"'})
+    async with httpx.AsyncClient() as client:
+        first = await fetch_conditional(client, cache, "http://test.com", "a", ["b"])
+        httpx_mock.reset(assert_all_responses_were_requested=True)
+        httpx_mock.add_response(status_code=304, match_headers={"If-None-Match": '"v1"'})
+        second = await fetch_conditional(client, cache, "http://test.com", "a", ["b"])
+    assert (first.status_code, first.regexp_found, first.patterns_found) == (200, True, {"b": False})
+    assert (second.status_code, second.regexp_found, second.patterns_found) == (304, True, {"b": False})
+
+
+@pytest.mark.asyncio
+async def test_fetch_conditional__other_patterns(httpx_mock):
+    cache = ChecksCache()
+    httpx_mock.add_response(status_code=200, data=b"aaa", headers={"Last-Modified": "Sun, 20 Dec 2020 00:00:00 GMT"})
+    async with httpx.AsyncClient() as client:
+        await fetch_conditional(client, cache, "http://test.com", "a")
+        check_result = await fetch_conditional(client, cache, "http://test.com", "b")
+    assert "If-Modified-Since" not in httpx_mock.get_requests()[1].headers
+    assert check_result.regexp_found is False
+
+
+def test_checks_cache__evicted():
+    cache = ChecksCache(size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
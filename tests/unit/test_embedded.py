@@ -0,0 +1,88 @@
+import asyncio
+from unittest import mock
+
+import httpx
+import pytest
+
+from service import config
+from service.embedded import EventsQueue, JobsQueue, MemoryStore, PgStore, run_pipeline
+from service.entities import SiteCheck
+from service.utils import AdaptiveLimiter, ChecksCache
+
+
+@pytest.mark.asyncio
+async def test_jobs_queue__deferred_order():
+    jobs = JobsQueue()
+    await jobs.enqueue_job("availability_check", "late", _job_id="late", _defer_by=0.05)
+    await jobs.enqueue_job("availability_check", "now", _job_id="now")
+    assert await jobs.zcard("arq:queue:availability_check") == 2
+    assert await jobs.get() == ("now", "availability_check", ("now",))
+    assert await jobs.get() == ("late", "availability_check", ("late",))
+
+
+@pytest.mark.asyncio
+async def test_jobs_queue__duplicate_till_done():
+    jobs = JobsQueue()
+    assert await jobs.enqueue_job("availability_check", 1, _job_id="availability_check:1") is not None
+    assert await jobs.enqueue_job("availability_check", 1, _job_id="availability_check:1") is None
+    job_id, _, _ = await jobs.get()
+    assert await jobs.enqueue_job("availability_check", 1, _job_id="availability_check:1") is None
+    jobs.done(job_id)
+    assert await jobs.enqueue_job("availability_check", 1, _job_id="availability_check:1") is not None
+
+
+@pytest.mark.asyncio
+async def test_jobs_queue__bounded():
+    jobs = JobsQueue(maxsize=1)
+    await jobs.enqueue_job("availability_check", 1, _job_id="1")
+    enqueue = asyncio.ensure_future(jobs.enqueue_job("availability_check", 2, _job_id="2"))
+    await asyncio.sleep(0.01)
+    assert not enqueue.done()
+    await jobs.get()
+    assert await asyncio.wait_for(enqueue, 1) == "2"
+
+
+@pytest.mark.asyncio
+async def test_jobs_queue__expired():
+    jobs = JobsQueue()
+    await jobs.enqueue_job("availability_check", 1, _job_id="1", _expires=0.01)
+    await asyncio.sleep(0.02)
+    await jobs.enqueue_job("availability_check", 2, _job_id="2")
+    assert await jobs.get() == ("2", "availability_check", (2,))
+    assert jobs.expired == 1
+    assert await jobs.enqueue_job("availability_check", 1, _job_id="1") == "1"
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline__memory_store(httpx_mock, monkeypatch):
+    monkeypatch.setattr(config, "SCHEDULE_JITTER_WINDOW", 0)
+    httpx_mock.add_response(status_code=200, data=b"ok")
+    store = MemoryStore([SiteCheck(id=i, url=f"http://test{i}.com", regexp="ok") for i in range(3)])
+    async with httpx.AsyncClient() as client:
+        ctx = {
+            "http_client": client,
+            "checks_cache": ChecksCache(),
+            "concurrency_limiter": AdaptiveLimiter(10, 10),
+            "redis_pool": JobsQueue(10),
+            "kafka_producer": EventsQueue(10),
+        }
+        pipeline = asyncio.ensure_future(run_pipeline(ctx, store, checkers=2))
+        for _ in range(100):
+            if len(store.events) == 3:
+                break
+            await asyncio.sleep(0.01)
+        pipeline.cancel()
+        await asyncio.gather(pipeline, return_exceptions=True)
+
+    assert sorted(event.url for event in store.events) == ["http://test0.com", "http://test1.com", "http://test2.com"]
+    assert all(event.status_code == 200 and event.regexp_found for event in store.events)
+    # sites aren't due again till next interval
+    assert all(next_check > 0 for next_check, _ in store.sites)
+
+
+@pytest.mark.asyncio
+async def test_pg_store__maintain():
+    pg_pool = object()
+    with mock.patch("service.embedded.maintain_events") as maintain_events:
+        await PgStore(pg_pool).maintain()
+    maintain_events.assert_called_once_with(pg_pool)
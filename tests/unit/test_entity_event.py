@@ -1,5 +1,7 @@
 from datetime import datetime
 
+import pytest
+
 from service.entities import Event
 
 
@@ -8,3 +10,60 @@ def test_serializer():
     serialized = event.serialize()
     restored_event = Event.deserialize(serialized)
     assert event == restored_event
+
+
+def test_serializer__nested():
+    event = Event(
+        id=None,
+        created_at=datetime(2020, 12, 12),
+        url="http://test.com",
+        duration=1.1,
+        patterns_found={"a": True},
+        timings={"queue": 0.1, "ttfb": 0.5},
+    )
+    assert Event.deserialize(event.serialize()) == event
+
+
+def test_serializer__microseconds():
+    event = Event(id=1, created_at=datetime(2020, 12, 12, 1, 2, 3, 4), url="http://test.com", duration=1.1)
+    assert Event.deserialize(event.serialize()) == event
+
+
+@pytest.mark.parametrize(
+    "event",
+    [
+        Event(id=None, created_at=datetime(2020, 12, 12), url="http://test.com", duration=1.1, status_code=200),
+        Event(id=1, created_at=datetime(2020, 12, 12, 1, 2, 3, 4), url="http://тест.бел", duration=0.0),
+        Event(id=2, created_at=datetime(1960, 1, 1), url="", duration=10.5, status_code=500, regexp_found=False),
+        Event(id=None, created_at=datetime(2020, 12, 12), url="http://test.com", duration=1.1, regexp_found=True),
+        Event(
+            id=3,
+            created_at=datetime(2020, 12, 12),
+            url="http://test.com",
+            duration=1.1,
+            status_code=200,
+            patterns_found={"a+": True, "б": False},
+        ),
+        Event(
+            id=4,
+            created_at=datetime(2020, 12, 12),
+            url="http://test.com",
+            duration=1.1,
+            status_code=200,
+            timings={"queue": 0.001, "ttfb": 0.5, "download": 0.25},
+        ),
+    ],
+)
+def test_binary_serializer(event):
+    serialized = event.serialize(binary=True)
+    assert serialized[:1] != b"{"
+    assert len(serialized) < len(event.serialize())
+    assert Event.deserialize(serialized) == event
+
+
+def test_binary_serializer__unsupported_version():
+    serialized = Event(id=None, created_at=datetime(2020, 12, 12), url="http://test.com", duration=1.1).serialize(
+        binary=True
+    )
+    with pytest.raises(ValueError):
+        Event.deserialize(b"\xff" + serialized[1:])
@@ -0,0 +1,126 @@
+import asyncio
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from service import config
+from service.http_client import connection_stats, host_slot, http_client_factory, timed_request, timing_phases
+from service.utils import fetch
+
+HTTP_CLIENT_CONFIG = {
+    "max_connections": 10,
+    "max_connections_per_host": None,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60,
+    "http2": False,
+}
+
+
+@pytest.fixture
+async def server_url():
+    active = {"current": 0, "max": 0}
+
+    async def handle(reader, writer):
+        while await reader.readuntil(b"\r\n\r\n"):
+            active["current"] += 1
+            active["max"] = max(active["max"], active["current"])
+            await asyncio.sleep(0.01)
+            active["current"] -= 1
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()
+    yield f"http://{host}:{port}/", active
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_keepalive_connection_reused(server_url):
+    url, _ = server_url
+    async with http_client_factory(HTTP_CLIENT_CONFIG) as client:
+        for _ in range(3):
+            response = await client.get(url)
+            assert response.content == b"ok"
+        assert connection_stats(client) == {"misses": 1, "hits": 2}
+
+
+@pytest.mark.asyncio
+async def test_connections_metric(server_url):
+    url, _ = server_url
+
+    def sample(result):
+        return REGISTRY.get_sample_value("site_checker_http_connections_total", {"result": result}) or 0
+
+    hits, misses = sample("hit"), sample("miss")
+    async with http_client_factory(HTTP_CLIENT_CONFIG) as client:
+        for _ in range(3):
+            await client.get(url)
+    assert sample("hit") == hits + 2
+    assert sample("miss") == misses + 1
+
+
+@pytest.mark.asyncio
+async def test_connections_per_host_limit(server_url):
+    url, active = server_url
+    async with http_client_factory(dict(HTTP_CLIENT_CONFIG, max_connections_per_host=2)) as client:
+        responses = await asyncio.gather(*(client.get(url) for _ in range(6)))
+        assert all(response.status_code == 200 for response in responses)
+        assert active["max"] == 2
+        assert connection_stats(client)["misses"] == 2
+        assert client._transport._host_semaphores == {}
+
+
+@pytest.mark.asyncio
+async def test_connections_per_host_pool_timeout(server_url):
+    url, _ = server_url
+    async with http_client_factory(dict(HTTP_CLIENT_CONFIG, max_connections_per_host=1)) as client:
+        async with client.stream("GET", url):
+            with pytest.raises(httpx.PoolTimeout):
+                await client.get(url, timeout=httpx.Timeout(1, pool=0.01))
+        assert (await client.get(url)).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_host_slot__saturated_host(server_url, monkeypatch):
+    url, active = server_url
+    monkeypatch.setattr(config, "FETCH_TIMEOUT", 0.025)
+
+    async def check(client):
+        async with host_slot(client, url):
+            event, _ = await fetch(client, url)
+        return event
+
+    async with http_client_factory(dict(HTTP_CLIENT_CONFIG, max_connections_per_host=1)) as client:
+        events = await asyncio.gather(*(check(client) for _ in range(5)))
+        assert client._transport._host_semaphores == {}
+    # checks wait for host before their clock starts, so they don't fail or last longer by the wait
+    assert [event.status_code for event in events] == [200] * 5
+    assert all(event.duration < config.FETCH_TIMEOUT for event in events)
+    assert active["max"] == 1
+
+
+@pytest.mark.asyncio
+async def test_timings__new_and_reused_connection(server_url):
+    url, _ = server_url
+    async with http_client_factory(HTTP_CLIENT_CONFIG) as client:
+        phases = []
+        for _ in range(2):
+            with timed_request() as marks:
+                await client.get(url)
+                marks["end"] = marks["headers"]
+            phases.append(timing_phases(marks))
+    assert sorted(phases[0]) == ["connect", "dns", "download", "queue", "ttfb"]
+    assert sorted(phases[1]) == ["download", "queue", "ttfb"]
+    assert all(duration >= 0 for duration in phases[0].values())
+    assert phases[0]["ttfb"] >= 0.01
+
+
+@pytest.mark.asyncio
+async def test_timings__connect_error():
+    async with http_client_factory(HTTP_CLIENT_CONFIG) as client:
+        with timed_request() as marks:
+            with pytest.raises(httpx.ConnectError):
+                await client.get("http://127.0.0.1:1/")
+    assert sorted(timing_phases(marks)) == ["dns", "queue"]
@@ -0,0 +1,147 @@
+import asyncio
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+from service import config
+from service.entities import Event
+from aiokafka.errors import KafkaTimeoutError
+
+from service.kafka import put_results_to_kafka, delivery_stats, replay_spool
+from service.spool import Spool
+
+
+class FakeProducer:
+    def __init__(self):
+        self.deliveries = []
+
+    async def send(self, topic, value):
+        delivery = asyncio.get_event_loop().create_future()
+        self.deliveries.append((topic, value, delivery))
+        return delivery
+
+    async def send_and_wait(self, topic, value):
+        delivery = await self.send(topic, value)
+        delivery.set_result(None)
+        return await delivery
+
+
+class StalledProducer(FakeProducer):
+    async def send(self, topic, value):
+        await asyncio.sleep(1)
+
+
+class FailingProducer(FakeProducer):
+    async def send(self, topic, value):
+        raise KafkaTimeoutError()
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=1024, max_size=4096)
+    yield spool
+    spool.close()
+
+
+@pytest.fixture
+def event():
+    return Event(id=None, created_at=datetime(2020, 12, 12), url="http://test.com", duration=1.1, status_code=200)
+
+
+@pytest.mark.asyncio
+async def test_put_results__wait_delivery(event):
+    producer = FakeProducer()
+    delivered = delivery_stats["delivered"]
+    with mock.patch.object(config, "KAFKA_PRODUCER_WAIT_DELIVERY", True):
+        await put_results_to_kafka(producer, event)
+    assert [(topic, Event.deserialize(value)) for topic, value, _ in producer.deliveries] == [
+        (config.KAFKA_TOPIC, event)
+    ]
+    assert delivery_stats["delivered"] == delivered + 1
+
+
+@pytest.mark.asyncio
+async def test_put_results__background_delivery(event):
+    producer = FakeProducer()
+    delivered, failed = delivery_stats["delivered"], delivery_stats["failed"]
+    with mock.patch.object(config, "KAFKA_PRODUCER_WAIT_DELIVERY", False):
+        await put_results_to_kafka(producer, event)
+        await put_results_to_kafka(producer, event)
+    assert delivery_stats["delivered"] == delivered
+    assert delivery_stats["failed"] == failed
+
+    producer.deliveries[0][2].set_result(None)
+    producer.deliveries[1][2].set_exception(ConnectionError())
+    await asyncio.sleep(0)
+    assert delivery_stats["delivered"] == delivered + 1
+    assert delivery_stats["failed"] == failed + 1
+
+
+@pytest.mark.asyncio
+async def test_put_results__spool_on_timeout(event, spool):
+    with mock.patch.object(config, "KAFKA_SPOOL_TIMEOUT", 0.01):
+        await put_results_to_kafka(StalledProducer(), event, spool)
+        await put_results_to_kafka(FailingProducer(), event, spool)
+    assert [Event.deserialize(value) for value in spool.read(10)] == [event, event]
+
+
+@pytest.mark.asyncio
+async def test_put_results__spool_pending(event, spool):
+    spool.append(b"spooled")
+    producer = FakeProducer()
+    with mock.patch.object(config, "KAFKA_PRODUCER_WAIT_DELIVERY", True):
+        await put_results_to_kafka(producer, event, spool)
+    assert producer.deliveries == []
+    assert spool.read(10)[0] == b"spooled"
+    assert Event.deserialize(spool.read(10)[1]) == event
+
+
+@pytest.mark.asyncio
+async def test_put_results__spool_failed_background_delivery(event, spool):
+    producer = FakeProducer()
+    with mock.patch.object(config, "KAFKA_PRODUCER_WAIT_DELIVERY", False):
+        await put_results_to_kafka(producer, event, spool)
+        await put_results_to_kafka(producer, event, spool)
+    producer.deliveries[0][2].set_result(None)
+    producer.deliveries[1][2].set_exception(KafkaTimeoutError())
+    await asyncio.sleep(0)
+    assert [Event.deserialize(value) for value in spool.read(10)] == [event]
+
+
+@pytest.mark.asyncio
+async def test_replay_spool(spool):
+    for i in range(5):
+        spool.append(b"event %d" % i)
+    producer = FakeProducer()
+    with mock.patch.object(config, "KAFKA_SPOOL_REPLAY_BATCH", 3):
+        replay = asyncio.ensure_future(replay_spool(producer, spool))
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert [value for _, value, _ in producer.deliveries] == [b"event 0", b"event 1", b"event 2"]
+        assert spool.pending == 5
+        for _, _, delivery in producer.deliveries:
+            delivery.set_result(None)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        replay.cancel()
+    assert spool.pending == 2
+    assert [value for _, value, _ in producer.deliveries][3:] == [b"event 3", b"event 4"]
+
+
+@pytest.mark.asyncio
+async def test_replay_spool__not_kafka_error(spool, caplog):
+    spool.append(b"event 0")
+    producer = FakeProducer()
+    with mock.patch.object(config, "KAFKA_SPOOL_REPLAY_INTERVAL", 0.01):
+        with mock.patch.object(spool, "read", side_effect=[OSError("mmap read failed"), ValueError("corrupt")]):
+            replay = asyncio.ensure_future(replay_spool(producer, spool))
+            await asyncio.sleep(0.03)
+            assert not replay.done()
+        await asyncio.sleep(0.02)
+        replay.cancel()
+        await asyncio.gather(replay, return_exceptions=True)
+    assert "failed spooled events replay" in caplog.text
+    assert "mmap read failed" in caplog.text and "corrupt" in caplog.text
+    # replay goes on after errors
+    assert [value for _, value, _ in producer.deliveries] == [b"event 0"]
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import pytest
+
+from service import metrics
+from service.utils import AdaptiveLimiter
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter__concurrency():
+    limiter = AdaptiveLimiter(2, 2)
+    active = {"current": 0, "max": 0}
+
+    async def check():
+        async with limiter.slot():
+            active["current"] += 1
+            active["max"] = max(active["max"], active["current"])
+            await asyncio.sleep(0.01)
+            active["current"] -= 1
+
+    await asyncio.gather(*(check() for _ in range(6)))
+    assert active["max"] == 2
+    assert limiter._in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter__cancelled_waiter():
+    limiter = AdaptiveLimiter(1, 1)
+    async with limiter.slot():
+        waiter = asyncio.ensure_future(limiter.slot().__aenter__())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+    assert limiter._in_flight == 0
+    assert not limiter._waiters
+
+
+def test_adaptive_limiter__slow_start_and_additive_increase():
+    limiter = AdaptiveLimiter(2, 100)
+    for _ in range(6):
+        limiter.observe(0.1)
+    assert limiter.limit == 8
+    limiter.lag = 1
+    for _ in range(8):
+        limiter.observe(0.1)
+    assert limiter.limit == 6
+    limiter.lag = 0
+    for _ in range(6):
+        limiter.observe(0.1)
+    assert limiter.limit == 7
+
+
+def test_adaptive_limiter__latency_inflation():
+    limiter = AdaptiveLimiter(2, 100)
+    for _ in range(20):
+        limiter.observe(0.1)
+    limit = limiter.limit
+    for _ in range(limit):
+        limiter.observe(10)
+    assert limiter.limit == int(limit * 0.75)
+    assert metrics.CHECKS_CONCURRENCY_LIMIT._value.get() == limiter.limit
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter__lag_monitor():
+    limiter = AdaptiveLimiter(2, 100)
+    monitor = asyncio.ensure_future(limiter.monitor_lag(0.01))
+    await asyncio.sleep(0.005)
+    time.sleep(0.05)
+    await asyncio.sleep(0.01)
+    monitor.cancel()
+    assert limiter.lag >= 0.03
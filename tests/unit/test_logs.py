@@ -0,0 +1,98 @@
+import json
+import logging
+import queue
+import sys
+from unittest import mock
+
+import pytest
+
+from service import logs
+
+
+def record(msg, level=logging.INFO, sampled=True):
+    result = logging.LogRecord("root", level, __file__, 1, msg, ("http://test.com",), None)
+    if sampled:
+        result.sampled = True
+    return result
+
+
+@pytest.mark.parametrize("rate,kept", [(1, 10), (0.25, 3), (0.001, 1), (0, 0)])
+def test_sampling_filter(rate, kept):
+    sampling = logs.SamplingFilter(rate)
+    assert sum(sampling.filter(record("check %s")) for _ in range(10)) == kept
+
+
+def test_sampling_filter__per_message():
+    sampling = logs.SamplingFilter(0.5)
+    assert [sampling.filter(record(msg)) for msg in ("a %s", "b %s", "a %s", "b %s", "a %s")] == [
+        True,
+        True,
+        False,
+        False,
+        True,
+    ]
+
+
+def test_sampling_filter__not_sampled_records():
+    sampling = logs.SamplingFilter(0)
+    assert sampling.filter(record("started %s", sampled=False))
+    assert sampling.filter(record("failed %s", level=logging.ERROR))
+
+
+def test_queue_handler__formatted_by_listener():
+    records = queue.SimpleQueue()
+    handler = logs.LoopQueueHandler(records)
+    handler.handle(record("check %s"))
+    queued = records.get_nowait()
+    assert queued.msg == "check %s"
+    assert queued.getMessage() == "check http://test.com"
+
+
+def test_summary():
+    with mock.patch("service.logs.time.monotonic", side_effect=[0, 1, 5, 10, 10, 11, 25]), mock.patch.object(
+        logs.logger, "info"
+    ) as info:
+        summary = logs.Summary("checked sites", interval=10)
+        summary.add("ok")
+        summary.add("http_error")
+        assert not info.called
+        summary.add("ok")
+        info.assert_called_once_with(
+            "%s %s in %.1fs: %s",
+            "checked sites",
+            3,
+            10,
+            {"ok": 2, "http_error": 1},
+            extra={"summary": "checked sites", "count": 3, "duration": 10, "counts": {"ok": 2, "http_error": 1}},
+        )
+        summary.add(count=5)
+        summary.flush()
+        assert info.call_args == mock.call(
+            "%s %s in %.1fs: %s",
+            "checked sites",
+            5,
+            15,
+            {"total": 5},
+            extra={"summary": "checked sites", "count": 5, "duration": 15, "counts": {"total": 5}},
+        )
+
+
+def test_json_formatter():
+    summary = record("checked %s", sampled=True)
+    summary.__dict__.update(summary="checked sites", count=3, counts={"ok": 3})
+    fields = json.loads(logs.JsonFormatter().format(summary))
+    assert fields.pop("time")
+    assert fields == {
+        "level": "INFO",
+        "logger": "root",
+        "message": "checked http://test.com",
+        "summary": "checked sites",
+        "count": 3,
+        "counts": {"ok": 3},
+    }
+
+    try:
+        raise ValueError("failed")
+    except ValueError:
+        failed = logging.LogRecord("root", logging.ERROR, __file__, 1, "failed", (), sys.exc_info())
+    assert "ValueError: failed" in json.loads(logs.JsonFormatter().format(failed))["exc_info"]
@@ -0,0 +1,54 @@
+import asyncio
+from collections import namedtuple
+from datetime import datetime
+from unittest import mock
+
+import pytest
+from aiokafka.structs import TopicPartition
+from prometheus_client import REGISTRY
+
+from service import config, metrics
+from service.entities import Event
+from service.kafka import put_results_to_kafka, report_consumer_lag
+
+
+Message = namedtuple("Message", ["offset", "value"])
+
+
+class FakeConsumer:
+    def highwater(self, tp):
+        return {0: 100}.get(tp.partition)
+
+
+@pytest.mark.parametrize(
+    "status_code,outcome", [(200, "ok"), (304, "ok"), (404, "http_error"), (None, "network_error")]
+)
+def test_fetch_outcome(status_code, outcome):
+    event = Event(id=None, created_at=datetime(2020, 12, 12), url="http://test.com", duration=1.1)
+    event.status_code = status_code
+    assert metrics.fetch_outcome(event) == outcome
+
+
+def test_report_consumer_lag():
+    report_consumer_lag(FakeConsumer(), TopicPartition("events", 0), [Message(10, b""), Message(19, b"")])
+    report_consumer_lag(FakeConsumer(), TopicPartition("events", 1), [Message(10, b"")])
+    assert REGISTRY.get_sample_value("site_checker_kafka_consumer_lag", {"partition": "0"}) == 80
+    assert REGISTRY.get_sample_value("site_checker_kafka_consumer_lag", {"partition": "1"}) is None
+
+
+@pytest.mark.asyncio
+async def test_kafka_produce_duration__background_delivery():
+    class Producer:
+        async def send(self, topic, value):
+            self.delivery = asyncio.get_event_loop().create_future()
+            return self.delivery
+
+    producer = Producer()
+    observed = REGISTRY.get_sample_value("site_checker_kafka_produce_duration_seconds_count")
+    event = Event(id=None, created_at=datetime(2020, 12, 12), url="http://test.com", duration=1.1)
+    with mock.patch.object(config, "KAFKA_PRODUCER_WAIT_DELIVERY", False):
+        await put_results_to_kafka(producer, event)
+    assert REGISTRY.get_sample_value("site_checker_kafka_produce_duration_seconds_count") == observed
+    producer.delivery.set_result(None)
+    await asyncio.sleep(0)
+    assert REGISTRY.get_sample_value("site_checker_kafka_produce_duration_seconds_count") == observed + 1
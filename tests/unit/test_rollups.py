@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+
+from service.entities import Event
+from service.rollups import HOUR, MINUTE, aggregate_rollups, latency_bucket, merge_sketches, sketch_quantile
+
+
+def test_latency_bucket():
+    assert latency_bucket(0) == 0
+    assert latency_bucket(0.001) == 0
+    assert latency_bucket(0.1) < latency_bucket(0.2) < latency_bucket(1) < latency_bucket(10)
+    assert latency_bucket(10000) == latency_bucket(100000)
+
+
+def test_sketch_quantile():
+    durations = [i / 1000 for i in range(1, 1001)]
+    sketch = merge_sketches(*({latency_bucket(d): 1} for d in durations))
+    assert sum(sketch.values()) == 1000
+    assert sketch_quantile(sketch, 0.5) == pytest.approx(0.5, rel=0.05)
+    assert sketch_quantile(sketch, 0.95) == pytest.approx(0.95, rel=0.05)
+    assert sketch_quantile(sketch, 1) == pytest.approx(1, rel=0.05)
+    with pytest.raises(ValueError):
+        sketch_quantile({}, 0.5)
+
+
+def test_aggregate_rollups():
+    events = [
+        Event(None, datetime(2020, 12, 20, 10, 1, 1), "http://b.com", 0.2, 200, True),
+        Event(None, datetime(2020, 12, 20, 10, 1, 30), "http://b.com", 0.4, 500, False),
+        Event(None, datetime(2020, 12, 20, 10, 2, 1), "http://b.com", 1.0, None, None),
+        Event(None, datetime(2020, 12, 20, 10, 1, 1), "http://a.com", 0.1, 200, None),
+    ]
+    rollups = aggregate_rollups(events, MINUTE)
+    assert [(r.url, r.bucket, r.count) for r in rollups] == [
+        ("http://a.com", datetime(2020, 12, 20, 10, 1), 1),
+        ("http://b.com", datetime(2020, 12, 20, 10, 1), 2),
+        ("http://b.com", datetime(2020, 12, 20, 10, 2), 1),
+    ]
+
+    rollups = aggregate_rollups(events, HOUR)
+    assert len(rollups) == 2
+    rollup = rollups[1]
+    assert rollup.bucket == datetime(2020, 12, 20, 10)
+    assert rollup.count == 3
+    assert rollup.failures == 2
+    assert rollup.regexp_misses == 1
+    assert rollup.duration_min == 0.2
+    assert rollup.duration_max == 1.0
+    assert rollup.duration_sum == pytest.approx(1.6)
+    assert sum(rollup.latency_sketch.values()) == 3
@@ -0,0 +1,178 @@
+import asyncio
+from unittest import mock
+
+import arq
+import pytest
+
+from prometheus_client import REGISTRY
+
+from service import config
+from service.entities import SiteCheck
+from service.jobs import AvailabilityCheckerWorkerSettings, availability_check_batch, enqueue_availability_checks
+from service.utils import schedule_jitter
+
+
+class FakeRedis:
+    SET_IF_NOT_EXIST = "SET_IF_NOT_EXIST"
+
+    def __init__(self, queued=0):
+        self.jobs = []
+        self.job_ids = set()
+        self.keys = {}
+        self.queued = queued
+
+    async def enqueue_job(self, function, *args, _job_id=None, _queue_name=None, _defer_by=None, _expires=None):
+        if _job_id in self.job_ids:
+            return None
+        self.job_ids.add(_job_id)
+        self.jobs.append((function, args, _defer_by))
+        return _job_id
+
+    async def zcard(self, key):
+        return self.queued + len(self.jobs)
+
+    async def set(self, key, value, *, expire=0, pexpire=0, exist=None):
+        if exist == self.SET_IF_NOT_EXIST and key in self.keys:
+            return None
+        self.keys[key] = pexpire
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.keys.pop(key, None)
+
+
+async def site_checks(count, interval=60):
+    for i in range(count):
+        yield SiteCheck(id=i, url=f"http://site{i}.test", interval=interval)
+
+
+def test_schedule_jitter():
+    assert schedule_jitter("http://test.com", 60) == schedule_jitter("http://test.com", 60)
+    assert 0 <= schedule_jitter("http://test.com", 60) < 60
+    assert schedule_jitter("http://test.com", 0) == 0
+    jitters = [schedule_jitter(f"http://site{i}.test", 60) for i in range(600)]
+    assert all(0 < sum(1 for j in jitters if s <= j < s + 10) < 200 for s in range(0, 60, 10))
+
+
+@pytest.mark.asyncio
+async def test_enqueue__jitter():
+    redis = FakeRedis()
+    assert await enqueue_availability_checks(redis, site_checks(10), jitter_window=60) == 10
+    assert [function for function, _, _ in redis.jobs] == ["availability_check"] * 10
+    assert [defer_by for _, (site_check,), defer_by in redis.jobs] == [
+        schedule_jitter(site_check.url, 60) for _, (site_check,), _ in redis.jobs
+    ]
+
+    redis = FakeRedis()
+    await enqueue_availability_checks(redis, site_checks(10, interval=10), jitter_window=60)
+    assert all(defer_by < 10 for _, _, defer_by in redis.jobs)
+
+
+@pytest.mark.asyncio
+async def test_enqueue__batch_jitter():
+    redis = FakeRedis()
+    assert await enqueue_availability_checks(redis, site_checks(1000), batch_size=10, jitter_window=60) == 1000
+    assert all(function == "availability_check_batch" for function, _, _ in redis.jobs)
+    assert sum(len(batch) for _, (batch,), _ in redis.jobs) == 1000
+    for _, (batch,), defer_by in redis.jobs:
+        assert 0 < len(batch) <= 10
+        assert all(int(schedule_jitter(site_check.url, 60)) == defer_by for site_check in batch)
+
+
+@pytest.mark.asyncio
+async def test_enqueue__duplicates_skipped():
+    redis = FakeRedis()
+    skipped = REGISTRY.get_sample_value("site_checker_skipped_checks_total", {"reason": "duplicate"}) or 0
+    assert await enqueue_availability_checks(redis, site_checks(10)) == 10
+    assert await enqueue_availability_checks(redis, site_checks(12)) == 2
+    assert await enqueue_availability_checks(redis, site_checks(12), batch_size=5) == 12
+    assert await enqueue_availability_checks(redis, site_checks(12), batch_size=5) == 0
+    assert REGISTRY.get_sample_value("site_checker_skipped_checks_total", {"reason": "duplicate"}) == skipped + 22
+
+
+class FailingRedis(FakeRedis):
+    def __init__(self, fail_after):
+        super().__init__()
+        self.fail_after = fail_after
+
+    async def enqueue_job(self, function, *args, **kwargs):
+        if len(self.jobs) >= self.fail_after:
+            raise ConnectionError("redis is down")
+        return await super().enqueue_job(function, *args, **kwargs)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("batch_size,lost", [(1, 1), (3, 3)])
+async def test_enqueue__error_counts_lost_sites(batch_size, lost):
+    closed = []
+
+    async def claimed_sites():
+        try:
+            async for site_check in site_checks(10):
+                yield site_check
+        except GeneratorExit:
+            closed.append(True)
+            raise
+
+    errors = REGISTRY.get_sample_value("site_checker_skipped_checks_total", {"reason": "error"}) or 0
+    with pytest.raises(ConnectionError):
+        await enqueue_availability_checks(FailingRedis(fail_after=2), claimed_sites(), batch_size=batch_size)
+    # not read sites are left to reader, read but not queued ones are lost
+    assert closed == [True]
+    assert REGISTRY.get_sample_value("site_checker_skipped_checks_total", {"reason": "error"}) == errors + lost
+
+
+async def site_checks_range(start, stop):
+    for i in range(start, stop):
+        yield SiteCheck(id=i, url=f"http://site{i}.test")
+
+
+@pytest.mark.asyncio
+async def test_enqueue__batch_duplicates_with_other_batches():
+    redis = FakeRedis()
+    assert await enqueue_availability_checks(redis, site_checks_range(0, 12), batch_size=5) == 12
+    # due sites changed, so batches of the next tick differ, but queued sites aren't queued again
+    assert await enqueue_availability_checks(redis, site_checks_range(5, 16), batch_size=5) == 4
+    queued = [site_check.id for _, (batch,), _ in redis.jobs for site_check in batch]
+    assert sorted(queued) == list(range(16))
+    assert redis.keys["availability_check_batch:site:0"] == 60000
+
+    _, (batch,), _ = redis.jobs[0]
+    with mock.patch("service.jobs.availability_check") as availability_check:
+        await availability_check_batch({"redis_pool": redis}, batch)
+    assert availability_check.call_count == len(batch)
+    redis.job_ids.clear()  # arq removes key of done job
+    assert await enqueue_availability_checks(redis, site_checks_range(0, 16), batch_size=5) == len(batch)
+
+
+@pytest.mark.asyncio
+async def test_availability_check_batch__cancelled(caplog):
+    redis = FakeRedis()
+    await enqueue_availability_checks(redis, site_checks(3), batch_size=3)
+    _, (batch,), _ = redis.jobs[0]
+
+    async def availability_check(ctx, site_check):
+        if site_check.id:
+            await asyncio.sleep(1)
+
+    with mock.patch("service.jobs.availability_check", availability_check):
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(availability_check_batch({"redis_pool": redis}, batch), 0.01)
+    assert "unfinished checks: 2 ['http://site1.test', 'http://site2.test']" in caplog.text
+    assert redis.keys == {}
+
+
+def test_availability_check_batch__timeout():
+    functions = {function.name: function for function in map(arq.func, AvailabilityCheckerWorkerSettings.functions)}
+    assert functions["availability_check_batch"].timeout_s == config.AVAILABILITY_CHECK_BATCH_TIMEOUT
+    assert config.AVAILABILITY_CHECK_BATCH_TIMEOUT >= config.SCHEDULE_BATCH_SIZE * config.FETCH_TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_enqueue__high_water():
+    redis = FakeRedis(queued=95)
+    assert await enqueue_availability_checks(redis, site_checks(10), high_water=100) == 5
+    assert await enqueue_availability_checks(redis, site_checks(20, interval=120), high_water=100) == 0
+    redis = FakeRedis(queued=98)
+    assert await enqueue_availability_checks(redis, site_checks(10), batch_size=3, high_water=100) == 6
@@ -0,0 +1,78 @@
+import os
+
+from service.spool import Spool
+
+
+def test_spool__append_read_commit(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=64, max_size=1024)
+    for i in range(10):
+        assert spool.append(b"event %d" % i)
+    assert spool.pending == 10
+    # 11 bytes per record, so 5 records per segment
+    assert len(os.listdir(tmp_path)) == 2
+
+    assert spool.read(3) == [b"event 0", b"event 1", b"event 2"]
+    assert spool.read(3) == [b"event 0", b"event 1", b"event 2"]
+    spool.commit(3)
+    assert spool.read(4) == [b"event 3", b"event 4", b"event 5", b"event 6"]
+    spool.commit(4)
+    assert spool.pending == 3
+    assert len(os.listdir(tmp_path)) == 1
+    assert spool.read(10) == [b"event 7", b"event 8", b"event 9"]
+    spool.commit(3)
+    assert spool.pending == 0
+    assert spool.read(10) == []
+    assert os.listdir(tmp_path) == []
+
+    assert spool.append(b"event 10")
+    assert spool.read(10) == [b"event 10"]
+    spool.close()
+
+
+def test_spool__max_size(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=32, max_size=64)
+    assert [spool.append(b"event %d" % i) for i in range(7)] == [True] * 4 + [False] * 3
+    assert spool.full
+    assert not spool.append(b"x" * 32)
+    spool.commit(len(spool.read(2)))
+    assert spool.append(b"event 7")
+    assert not spool.full
+    assert spool.read(10) == [b"event 2", b"event 3", b"event 7"]
+    spool.close()
+
+
+def test_spool__reopen(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=64, max_size=1024)
+    for i in range(7):
+        spool.append(b"event %d" % i)
+    spool.commit(len(spool.read(2)))
+    spool.close()
+
+    # read position isn't persisted, so not removed segment is read again
+    spool = Spool(str(tmp_path), segment_size=64, max_size=1024)
+    assert spool.pending == 7
+    assert spool.read(10) == [b"event %d" % i for i in range(7)]
+    spool.append(b"event 7")
+    spool.commit(5)
+    assert spool.read(10) == [b"event 5", b"event 6", b"event 7"]
+    spool.close()
+
+
+def test_spool__reopen_segment_size_changed(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=64, max_size=1024)
+    for i in range(7):
+        spool.append(b"event %d" % i)
+    spool.close()
+
+    # existing segments are mapped at their own size
+    for segment_size in (128, 32):
+        spool = Spool(str(tmp_path), segment_size=segment_size, max_size=1024)
+        assert spool.read(10) == [b"event %d" % i for i in range(7)]
+        spool.close()
+
+    spool = Spool(str(tmp_path), segment_size=128, max_size=1024)
+    for i in range(7, 11):
+        spool.append(b"event %d" % i)
+    assert sorted(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path)) == [64, 64, 128]
+    assert spool.read(11) == [b"event %d" % i for i in range(11)]
+    spool.close()
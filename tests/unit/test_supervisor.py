@@ -0,0 +1,43 @@
+import os
+import signal
+import sys
+import threading
+import time
+from unittest import mock
+
+from service import config
+from service.jobs import AvailabilityCheckerWorkerSettings
+from service.supervisor import Supervisor, run_checker
+
+
+def wait_for_stop(index):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if index == 0 and os.environ.get("TEST_CHECKER_EXIT"):
+        sys.exit(1)
+    time.sleep(60)
+
+
+def test_supervise__stop_on_signal():
+    threading.Timer(1, lambda: os.kill(os.getpid(), signal.SIGTERM)).start()
+    start = time.monotonic()
+    assert Supervisor(2, target=wait_for_stop).run() == 0
+    assert time.monotonic() - start < 30
+
+
+def test_supervise__stop_on_worker_exit(monkeypatch):
+    monkeypatch.setenv("TEST_CHECKER_EXIT", "1")
+    start = time.monotonic()
+    assert Supervisor(2, target=wait_for_stop).run() == 1
+    assert time.monotonic() - start < 30
+
+
+def test_run_checker__own_metrics_port_and_spool(monkeypatch):
+    monkeypatch.setattr(config, "METRICS_PORT", 9100)
+    monkeypatch.setattr(config, "KAFKA_SPOOL_PATH", "/var/spool/site_checker")
+    with mock.patch("arq.run_worker") as run_worker:
+        run_checker(2)
+    run_worker.assert_called_once_with(AvailabilityCheckerWorkerSettings)
+    # standalone checker worker starts metrics server too, supervised one on its own port
+    assert AvailabilityCheckerWorkerSettings.on_startup.keywords["metrics_server"]
+    assert config.METRICS_PORT == 9102
+    assert config.KAFKA_SPOOL_PATH == "/var/spool/site_checker/checker-2"